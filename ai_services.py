@@ -3,72 +3,436 @@ import json
 import re
 import requests
 import time
-from typing import List, Dict, Any, Optional
-from requests.adapters import HTTPAdapter, Retry
+import asyncio
+import hashlib
+import weakref
+import threading
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+from requests.adapters import HTTPAdapter
 
-class AIServices:
-    def __init__(self):
-        # Using IBM Granite 3.1 2B model via Hugging Face Inference API
-        self.model_name = "ibm-granite/granite-3.1-2b-instruct"
-        self.api_url = f"https://api-inference.huggingface.co/models/{self.model_name}"
-        self.api_key = os.getenv("HUGGINGFACE_API_KEY")
-        
-        if not self.api_key:
-            raise ValueError("Hugging Face API key not found. Please set HUGGINGFACE_API_KEY in your environment variables.")
-            
-        self.headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+from caching import LRUCache, ResponseCache, SingleFlight
+from tokenization import load_token_counter, pack_chunks, truncate_to_budget
+from retrieval import BM25Index, HybridRetriever, QuestionCache
+from vector_index import load_embedder
+from pdf_processor import ChunkIndex
+from backends import InferenceBackend, load_backend
+from resilience import OPEN, CircuitOpenError, shared_breaker, shared_limiter
+
+try:
+    import httpx
+except ImportError:  # Optional: the async client needs the `httpx` package
+    httpx = None
+
+# Chat template the prompt is wrapped in before it is sent to the model
+PROMPT_FORMAT = "<|system|>\nYou are a helpful AI assistant specialized in analyzing academic documents.\n\n{prompt}\n<|assistant|>\n"
+
+# Placeholder for document content in prompt templates; see AIServices._fill_prompt
+CONTENT_SLOT = "\x00content\x00"
+
+# Responses worth retrying, after the limiter's backoff, in both the sync and async clients
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+MAX_RETRIES = 3
+
+SECTION_SUMMARY_PROMPT = f"""
+        Summarize the following section of a longer academic document in one detailed paragraph.
+        Keep the main arguments, key findings, important concepts, definitions and figures,
+        so the summary can later be combined with summaries of the other sections.
         
-        # Configure retry strategy
+        Section:
+        {CONTENT_SLOT}
+        """
+
+# One keep-alive connection pool per event loop. Coroutines submitted through
+# run_async all share the background loop, and so a single pool per process.
+_async_clients = weakref.WeakKeyDictionary()
+_async_lock = threading.Lock()
+_background_loop = None
+
+# Identical prompts in flight at the same time, from any session or thread in
+# the process, are sent to the model once
+_single_flight = SingleFlight()
+
+def _shared_async_client(max_connections: int) -> "httpx.AsyncClient":
+    """The keep-alive httpx client for the running event loop, created on first use"""
+    if httpx is None:
+        raise ImportError("The 'httpx' package is required for the async client")
+    loop = asyncio.get_running_loop()
+    with _async_lock:
+        client = _async_clients.get(loop)
+        if client is None or client.is_closed:
+            limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+            client = httpx.AsyncClient(limits=limits, timeout=30)
+            _async_clients[loop] = client
+    return client
+
+def run_async(coroutine):
+    """Run a coroutine on the process-wide background event loop and wait for its result"""
+    global _background_loop
+    with _async_lock:
+        if _background_loop is None:
+            _background_loop = asyncio.new_event_loop()
+            threading.Thread(target=_background_loop.run_forever, name="studymate-async", daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coroutine, _background_loop).result()
+
+class AIServices:
+    def __init__(self, response_cache: Optional[ResponseCache] = None, use_response_cache: bool = True,
+                 backend: Optional[InferenceBackend] = None):
+        # IBM Granite 3.1 2B via the Hugging Face Inference API unless configured
+        # otherwise (see backends.load_backend)
+        self.backend = backend or load_backend()
+        self.model_name = self.backend.model_name
+        self.api_url = self.backend.url()
+        self.headers = self.backend.headers
+        
+        # Retries happen in _post rather than in urllib3, so the shared limiter
+        # sees every throttled response and can slow down the whole process
         self.session = requests.Session()
-        retries = Retry(
-            total=3,
-            backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504]
-        )
-        self.session.mount("https://", HTTPAdapter(max_retries=retries))
-        
-        print("Initialized AI Services with IBM Granite 3.1 2B model")
+        # Bounded number of concurrent model requests for chunked pipelines
+        self.max_concurrency = int(os.getenv("STUDYMATE_MAX_CONCURRENCY", "4"))
+        # Endpoints that take a list of inputs get generate_batch prompts batch_size at a time
+        batch_inputs = os.getenv("STUDYMATE_BATCH_INPUTS")
+        self.batch_inputs = self.backend.batch_inputs if batch_inputs is None else batch_inputs == "1"
+        self.batch_size = int(os.getenv("STUDYMATE_BATCH_SIZE", "8"))
+        adapter = HTTPAdapter(pool_maxsize=max(10, self.max_concurrency))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)  # Self-hosted servers on a private network
+        self.limiter = shared_limiter(self.api_url)
+        # While the endpoint is down, calls go straight to the local fallback
+        # instead of waiting out timeouts and retries
+        self.breaker = shared_breaker(self.api_url)
+        
+        # Prompts are sized in model tokens rather than characters
+        self.token_counter = load_token_counter()
+        self.context_window = int(os.getenv("STUDYMATE_CONTEXT_TOKENS", "8192"))
+        self._prompt_format_tokens = self.token_counter.count(PROMPT_FORMAT.format(prompt=""))
+        
+        # Partial summaries of document sections, keyed by a hash of the section
+        # text, so changing summary length or style only re-runs the final step
+        self._section_summary_cache = LRUCache(max_entries=4096)
+        
+        # Translated segments keyed by (model, segment hash, target language)
+        self.translation_segment_tokens = int(os.getenv("STUDYMATE_TRANSLATION_SEGMENT_TOKENS", "800"))
+        self._translation_cache = LRUCache(max_entries=8192)
+        
+        # Per-document search indexes and answer caches, keyed by a hash of the text
+        self._documents = LRUCache(max_entries=32)
+        
+        # Questions are answered from the best-matching chunks of the document,
+        # packed into at most retrieval_token_budget tokens, instead of its opening
+        self.retrieval_token_budget = int(os.getenv("STUDYMATE_RETRIEVAL_TOKENS", "3000"))
+        self.retrieval_chunk_words = 200
+        self.retrieval_chunk_overlap = 50
+        self.retrieval_candidates = 20
+        self.embedder = load_embedder()
+        
+        # Completions keyed by (model, prompt hash, generation parameters); generation
+        # runs at low temperature, so a repeated prompt can reuse the earlier answer
+        self.response_cache = response_cache
+        if self.response_cache is None and use_response_cache:
+            try:
+                self.response_cache = ResponseCache()
+            except Exception as e:
+                print(f"Response cache disabled: {str(e)}")
+        
+        print(f"Initialized AI Services with {self.model_name} via the {self.backend.name} backend")
     
+    def _post(self, payload: Dict[str, Any], stream: bool = False) -> requests.Response:
+        """
+        POST payload to the model endpoint through the shared rate limiter,
+        retrying throttled and failed attempts; returns a successful response.
+        Raises CircuitOpenError without calling out while the endpoint is down.
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            retryable = attempt < MAX_RETRIES
+            if not self.breaker.allow():
+                raise CircuitOpenError("API unavailable: circuit breaker is open")
+            # A streamed response holds its slot only until the headers arrive
+            started = self.limiter.acquire()
+            status_code = None
+            try:
+                response = self.session.post(self.backend.url(stream), headers=self.headers,
+                                             json=self.backend.body(payload, stream), timeout=30, stream=stream)
+                status_code = response.status_code
+            except requests.exceptions.RequestException as e:
+                self.breaker.record_failure()
+                if not retryable:
+                    raise Exception(f"API request failed: {str(e)}")
+                retry_after = None
+            except BaseException:
+                # Neither success nor an endpoint failure, but it must not leave a
+                # half-open circuit waiting forever on a probe that will never report
+                self.breaker.record_abandoned()
+                raise
+            else:
+                self._record_health(response.status_code)
+                if not (retryable and response.status_code in RETRY_STATUSES):
+                    try:
+                        response.raise_for_status()
+                    except requests.exceptions.HTTPError as e:
+                        raise Exception(f"API request failed: {str(e)} | Status: {response.status_code} | Response: {response.text}")
+                    return response
+                retry_after = response.headers.get("Retry-After")
+                response.close()
+            finally:
+                # Also on errors not handled here (a bad payload, a cancelled task),
+                # so the shared limiter never loses the slot
+                self.limiter.release(started, status_code)
+            if self.breaker.state == OPEN:
+                raise CircuitOpenError("API unavailable: circuit breaker is open")
+            time.sleep(self.limiter.retry_delay(attempt, retry_after))
+
+    def _record_health(self, status_code: int) -> None:
+        # Server errors count against the endpoint; throttling and client errors
+        # show it is up and answering
+        if status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def endpoint_status(self) -> Dict[str, Any]:
+        """Circuit breaker, rate limiter and request coalescing state of the model endpoint, for monitoring"""
+        return {"circuit": self.breaker.stats(), "limiter": self.limiter.stats(), "coalescing": _single_flight.stats()}
+
     def _make_api_request(self, payload: Dict[str, Any]) -> Dict[str, Any]:
         """Helper method to make API requests with error handling"""
-        try:
-            response = self.session.post(
-                self.api_url,
-                headers=self.headers,
-                json=payload,
-                timeout=30
-            )
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            error_msg = f"API request failed: {str(e)}"
-            if hasattr(e, 'response') and e.response is not None:
-                error_msg += f" | Status: {e.response.status_code} | Response: {e.response.text}"
-            raise Exception(error_msg)
+        return self._post(payload).json()
 
-    def _generate_response(self, prompt: str, max_length: int = 500) -> str:
-        """Generate response using IBM Granite model via API or fallback to rule-based processing"""
-        try:
-            # Try Hugging Face API first
-            payload = {
-                "inputs": f"<|system|>\nYou are a helpful AI assistant specialized in analyzing academic documents.\n\n{prompt}\n<|assistant|>\n",
-                "parameters": {
-                    "max_new_tokens": max_length,
-                    "temperature": 0.3,
-                    "return_full_text": False
-                }
+    async def _make_api_request_async(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Async counterpart of _make_api_request on the shared keep-alive pool"""
+        client = _shared_async_client(max(10, self.max_concurrency))
+        for attempt in range(MAX_RETRIES + 1):
+            retryable = attempt < MAX_RETRIES
+            if not self.breaker.allow():
+                raise CircuitOpenError("API unavailable: circuit breaker is open")
+            started = await self.limiter.acquire_async()
+            status_code = None
+            try:
+                response = await client.post(self.api_url, headers=self.headers, json=self.backend.body(payload))
+                status_code = response.status_code
+            except httpx.TransportError as e:
+                self.breaker.record_failure()
+                if not retryable:
+                    raise Exception(f"API request failed: {str(e)}")
+                retry_after = None
+            except BaseException:
+                self.breaker.record_abandoned()
+                raise
+            else:
+                self._record_health(response.status_code)
+                if not (retryable and response.status_code in RETRY_STATUSES):
+                    try:
+                        response.raise_for_status()
+                    except httpx.HTTPStatusError as e:
+                        raise Exception(f"API request failed: {str(e)} | Status: {response.status_code} | Response: {response.text}")
+                    return response.json()
+                retry_after = response.headers.get("Retry-After")
+            finally:
+                self.limiter.release(started, status_code)
+            if self.breaker.state == OPEN:
+                raise CircuitOpenError("API unavailable: circuit breaker is open")
+            await asyncio.sleep(self.limiter.retry_delay(attempt, retry_after))
+
+    def _content_budget(self, template: str, max_new_tokens: int) -> int:
+        """Tokens left for content in template after the rest of the prompt and the completion"""
+        budget = self.context_window - max_new_tokens - self._prompt_format_tokens
+        return budget - self.token_counter.count(template.replace(CONTENT_SLOT, ""))
+    
+    def _fill_prompt(self, template: str, content: str, max_new_tokens: int) -> str:
+        """
+        Insert content at CONTENT_SLOT in template, truncated to the tokens left
+        in the context window after the rest of the prompt and the completion
+        """
+        budget = self._content_budget(template, max_new_tokens)
+        return template.replace(CONTENT_SLOT, truncate_to_budget(content, budget, self.token_counter))
+    
+    def _build_payload(self, prompt: str, max_length: int, parameters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        payload = {
+            "inputs": PROMPT_FORMAT.format(prompt=prompt),
+            "parameters": {
+                "max_new_tokens": max_length,
+                "temperature": 0.3,
+                "return_full_text": False
             }
+        }
+        if parameters:
+            payload["parameters"].update(parameters)
+        return payload
+    
+    def _stream_model(self, prompt: str, max_length: int = 500) -> Iterator[str]:
+        """
+        Yield the completion for prompt piece by piece as the endpoint generates it
+        (server-sent events). Endpoints that ignore the stream flag and return the
+        whole completion as JSON yield it in one piece. Raises if the API call fails.
+        """
+        payload = self._build_payload(prompt, max_length)
+        key, cached = self._cached_response(payload)
+        if cached is not None:
+            yield cached
+            return
+        
+        response = self._post(payload, stream=True)
+        
+        with response:
+            if not response.headers.get("Content-Type", "").startswith("text/event-stream"):
+                text = self.backend.completions(response.json())[0].strip()
+                self._store_response(key, text)
+                yield text
+                return
             
+            pieces = []
+            # chunk_size=None hands over data as it arrives instead of filling a buffer first
+            for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                text = self.backend.stream_text(json.loads(data))
+                if not text:
+                    continue
+                # Leading whitespace of the completion is dropped, as _call_model strips it
+                text = text if pieces else text.lstrip()
+                if text:
+                    pieces.append(text)
+                    yield text
+        self._store_response(key, "".join(pieces).strip())
+    
+    def _cached_response(self, payload: Dict[str, Any]) -> tuple:
+        """Response key for payload and the cached completion, if any"""
+        key = ResponseCache.make_key(self.model_name, payload["inputs"], payload["parameters"],
+                                     f"{self.backend.name} {self.backend.base_url}")
+        if self.response_cache is None:
+            return key, None
+        return key, self.response_cache.get(key)
+    
+    def _store_response(self, key: str, text: str) -> None:
+        if self.response_cache is not None and text:
+            self.response_cache.put(key, text)
+    
+    def _call_model(self, prompt: str, max_length: int = 500) -> str:
+        """
+        Send a prompt to the model, or reuse a cached completion;
+        raises if the API call fails. Concurrent calls with the same prompt and
+        parameters share one request.
+        """
+        payload = self._build_payload(prompt, max_length)
+        key, cached = self._cached_response(payload)
+        if cached is not None:
+            return cached
+        return self._complete(key, payload)
+    
+    def _complete(self, key: str, payload: Dict[str, Any]) -> str:
+        """Request the completion for payload, sharing the request with concurrent identical calls"""
+        def request() -> str:
             response = self._make_api_request(payload)
-            return response[0]['generated_text'].strip()
+            text = self.backend.completions(response)[0].strip()
+            self._store_response(key, text)
+            return text
+        
+        return _single_flight.do(key, request)
+    
+    async def _call_model_async(self, prompt: str, max_length: int = 500) -> str:
+        payload = self._build_payload(prompt, max_length)
+        key, cached = self._cached_response(payload)
+        if cached is not None:
+            return cached
+        
+        async def request() -> str:
+            response = await self._make_api_request_async(payload)
+            text = self.backend.completions(response)[0].strip()
+            self._store_response(key, text)
+            return text
+        
+        return await _single_flight.do_async(key, request)
+    
+    def _generate_response(self, prompt: str, max_length: int = 500) -> str:
+        """Generate response using the model via API or fallback to rule-based processing"""
+        return self._generate_with_source(prompt, max_length)[0]
+    
+    def _generate_with_source(self, prompt: str, max_length: int = 500) -> tuple:
+        """_generate_response, plus whether the text came from the model rather than the fallback"""
+        try:
+            # Try Hugging Face API first
+            return self._call_model(prompt, max_length), True
             
         except Exception as e:
             print(f"API error, using fallback: {e}")
-            return self._fallback_processing(prompt)
+            return self._fallback_processing(prompt), False
+    
+    async def _generate_response_async(self, prompt: str, max_length: int = 500) -> str:
+        return (await self._generate_with_source_async(prompt, max_length))[0]
+    
+    async def _generate_with_source_async(self, prompt: str, max_length: int = 500) -> tuple:
+        try:
+            return await self._call_model_async(prompt, max_length), True
+        except Exception as e:
+            print(f"API error, using fallback: {e}")
+            # The fallback can itself call the model through the blocking client
+            return await asyncio.to_thread(self._fallback_processing, prompt), False
             
+    def generate_batch(self, prompts: List[str], params: Optional[Dict[str, Any]] = None,
+                       max_concurrency: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Completions for many prompts, in the same order. Each result is
+        {"text": completion, "error": None} or {"text": None, "error": message},
+        so a failed prompt doesn't fail the rest. params are generation
+        parameters such as max_new_tokens. Cached and repeated prompts are not
+        sent again; the others go batch_size at a time as list inputs when the
+        endpoint accepts them, otherwise as concurrent single requests.
+        """
+        params = dict(params or {})
+        max_length = params.pop("max_new_tokens", 500)
+        payloads = [self._build_payload(prompt, max_length, params) for prompt in prompts]
+        
+        outcomes = {}
+        pending = {}  # Response key -> payload, once per distinct prompt
+        keys = []
+        for payload in payloads:
+            key, cached = self._cached_response(payload)
+            keys.append(key)
+            if cached is not None:
+                outcomes[key] = {"text": cached, "error": None}
+            else:
+                pending.setdefault(key, payload)
+        
+        def complete(key: str) -> Dict[str, Any]:
+            try:
+                return {"text": self._complete(key, pending[key]), "error": None}
+            except Exception as e:
+                return {"text": None, "error": str(e)}
+        
+        with ThreadPoolExecutor(max_workers=max_concurrency or self.max_concurrency) as executor:
+            if self.batch_inputs and len(pending) > 1:
+                pending_keys = list(pending)
+                groups = [pending_keys[start:start + self.batch_size] for start in range(0, len(pending_keys), self.batch_size)]
+                for group, texts in zip(groups, executor.map(self._request_batch, [[pending[key] for key in group] for group in groups])):
+                    for key, text in zip(group, texts or []):
+                        self._store_response(key, text)
+                        outcomes[key] = {"text": text, "error": None}
+            
+            # Prompts not answered by a batch, or all of them without batching
+            remaining = [key for key in pending if key not in outcomes]
+            for key, outcome in zip(remaining, executor.map(complete, remaining)):
+                outcomes[key] = outcome
+        
+        return [dict(outcomes[key]) for key in keys]
+    
+    def _request_batch(self, payloads: List[Dict[str, Any]]) -> Optional[List[str]]:
+        """Completions for payloads sharing the same parameters in one request, or None if that fails"""
+        payload = {"inputs": [payload["inputs"] for payload in payloads], "parameters": payloads[0]["parameters"]}
+        try:
+            response = self._make_api_request(payload)
+            texts = [text.strip() for text in self.backend.completions(response)]
+        except Exception as e:
+            print(f"Batched request failed, sending its prompts one at a time: {e}")
+            return None
+        if len(texts) != len(payloads):
+            print(f"Batched request returned {len(texts)} completions for {len(payloads)} prompts, sending them one at a time")
+            return None
+        return texts
+    
     def _fallback_processing(self, prompt: str) -> str:
         """Enhanced fallback processing that actually analyzes content"""
         prompt_text = prompt.lower()
@@ -83,9 +447,11 @@ class AIServices:
         # Clean content for analysis
         content = content.strip()[:5000]  # Limit to first 5000 chars for processing
         
+        # The fallbacks work locally: they run when the model can't be reached,
+        # so calling back into it would only fail again
         if "summarize" in prompt_text:
             # Fallback for summarization
-            return self.summarize_content(content, "Brief", "Simple")
+            return self._create_text_summary(content, "Brief", "Simple")
         elif "translate to" in prompt_text:
             # Fallback for translation
             return f"I encountered an issue trying to translate. Please try again."
@@ -94,45 +460,153 @@ class AIServices:
             question_start = prompt_text.find("'") + 1
             question_end = prompt_text.find("'", question_start)
             question = prompt_text[question_start:question_end]
-            return self._find_relevant_content(content, question)
+            return self._find_relevant_content(content, question, indexed=False)
         else:
             # Default fallback: extract key topics
-            return self.extract_key_topics(content)
+            return self._extract_content_topics(content)
 
-    def _find_relevant_content(self, content: str, question: str) -> str:
+    def _document_state(self, content: str) -> Dict[str, Any]:
+        key = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        state = self._documents.get(key)
+        if state is None:
+            state = {}
+            self._documents.put(key, state)
+        return state
+    
+    def index_document(self, content: str, page_offsets: Optional[List[Tuple[int, int]]] = None) -> HybridRetriever:
         """
-        Find relevant content for the question using improved text matching
+        Chunk the document and build its search indexes. Called at upload time so
+        the first request doesn't pay for it; built on demand otherwise.
+        page_offsets (from pdf_processor.join_pages) lets answers cite pages.
         """
-        # Split into paragraphs first for better context
-        paragraphs = [p.strip() for p in content.split('\n\n') if p.strip()]
-        
-        # Clean and tokenize question
-        question_lower = question.lower()
-        question_keywords = set(re.findall(r'\b\w{4,}\b', question_lower))  # Only words with 4+ chars
-        
-        # Remove common words that don't add meaning
-        stopwords = {'what', 'when', 'where', 'why', 'how', 'the', 'and', 'your', 'this', 'that', 'with', 'from', 'they', 'have', 'been', 'were', 'will', 'would', 'could', 'should'}
-        question_keywords = {w for w in question_keywords if w not in stopwords}
-        
-        if not question_keywords:
-            return ""
-            
-        # Score each paragraph based on keyword matches
-        scored_paragraphs = []
-        for para in paragraphs:
-            para_lower = para.lower()
-            para_words = set(re.findall(r'\b\w+\b', para_lower))
-            
-            # Calculate overlap score
-            overlap = len(question_keywords.intersection(para_words))
-            if overlap > 0 and len(para) > 50:  # Only include meaningful paragraphs
-                # Add some weight if the paragraph contains question words
-                score = overlap + (0.5 if any(word in para_lower for word in ['because', 'therefore', 'thus', 'hence']) else 0)
-                scored_paragraphs.append((para, score))
+        return self._chunk_state(content, page_offsets)["retriever"]
+    
+    def _chunk_state(self, content: str, page_offsets: Optional[List[Tuple[int, int]]] = None) -> Dict[str, Any]:
+        state = self._document_state(content)
+        if "retriever" not in state:
+            chunks = ChunkIndex.build(content, self.retrieval_chunk_words, self.retrieval_chunk_overlap, page_offsets)
+            state["chunks"] = chunks
+            state["page_offsets"] = page_offsets or []
+            state["retriever"] = HybridRetriever.build(chunks, self.embedder)
+        elif page_offsets and not state["page_offsets"]:
+            # Built earlier by a call that had no page offsets (key terms, summaries, or a
+            # rebuild after eviction); adopt them now so answers can cite pages
+            state["chunks"].assign_pages(page_offsets)
+            state["page_offsets"] = page_offsets
+        return state
+    
+    def retrieve(self, content: str, query: str, k: int = 10, page_offsets: Optional[List[Tuple[int, int]]] = None,
+                 timings: Optional[Dict[str, float]] = None) -> List[int]:
+        """
+        Ids of the document chunks (see ChunkIndex) that best match query, best
+        first. This is the one retrieval path behind Q&A, focused summaries and
+        test generation: BM25 and vector rankings fused with reciprocal rank
+        fusion. Pass a dict as timings to get the time spent in each stage.
+        """
+        retriever = self._chunk_state(content, page_offsets)["retriever"]
+        return [chunk_id for chunk_id, _ in retriever.search(query, k, timings)]
+    
+    def _pages_in_span(self, page_offsets: List[Tuple[int, int]], start: int, end: int) -> List[int]:
+        first = bisect_right(page_offsets, (start, float('inf'))) - 1
+        last = bisect_right(page_offsets, (end - 1, float('inf'))) - 1
+        return [page for _, page in page_offsets[max(first, 0):last + 1]]
+    
+    def _retrieve_context(self, content: str, question: str, budget: int,
+                          page_offsets: Optional[List[Tuple[int, int]]] = None) -> Tuple[str, List[int]]:
+        """
+        The document chunks that best match question, packed greedily by rank into
+        budget tokens and returned in document order with page labels, along with
+        the pages they came from. Overlapping chunks are merged into one excerpt.
+        """
+        state = self._chunk_state(content, page_offsets)
+        chunks = state["chunks"]
+        
+        # Every chunk holds at least retrieval_chunk_words tokens, which bounds how many can fit
+        candidates = max(self.retrieval_candidates, budget // self.retrieval_chunk_words + 1)
+        selected, used = [], 0
+        for chunk_id in self.retrieve(content, question, candidates):
+            tokens = self.token_counter.count(chunks[chunk_id])
+            if used + tokens <= budget:
+                selected.append(chunk_id)
+                used += tokens
+        
+        spans = []
+        for chunk_id in sorted(selected, key=lambda chunk_id: chunks.starts[chunk_id]):
+            start, end, _ = chunks.span(chunk_id)
+            if spans and start <= spans[-1][1]:
+                spans[-1][1] = max(spans[-1][1], end)
+            else:
+                spans.append([start, end])
+        
+        excerpts, cited = [], []
+        for number, (start, end) in enumerate(spans, 1):
+            pages = self._pages_in_span(state["page_offsets"], start, end)
+            if not pages:
+                label = f"Excerpt {number}"
+            elif len(pages) == 1:
+                label = f"Page {pages[0]}"
+            else:
+                label = f"Pages {pages[0]}-{pages[-1]}"
+            excerpts.append(f"[{label}] {' '.join(content[start:end].split())}")
+            cited.extend(page for page in pages if page not in cited)
+        return "\n\n".join(excerpts), sorted(cited)
+    
+    def _grounded_prompt(self, template: str, content: str, question: str, max_new_tokens: int,
+                         page_offsets: Optional[List[Tuple[int, int]]] = None, budget: Optional[int] = None) -> Tuple[str, List[int]]:
+        """
+        Fill template with the whole document if it fits the budget (by default
+        retrieval_token_budget), otherwise with the chunks most relevant to
+        question. Returns the prompt and the pages it drew from: every page when
+        the whole document fits.
+        """
+        budget = min(self._content_budget(template, max_new_tokens), budget or self.retrieval_token_budget)
+        # No tokenizer averages 16 characters per token, so longer text can't fit
+        if len(content) <= budget * 16 and self.token_counter.count(content) <= budget:
+            return template.replace(CONTENT_SLOT, content), sorted({page for _, page in page_offsets or []})
+        
+        context, pages = self._retrieve_context(content, question, budget, page_offsets)
+        if not context:
+            # Nothing matched (e.g. "what is this about?"), so fall back to the opening
+            return self._fill_prompt(template, content, max_new_tokens), []
+        return template.replace(CONTENT_SLOT, context), pages
+    
+    def _cite_pages(self, answer: str, pages: List[int]) -> str:
+        if not pages:
+            return answer
+        ranges = []
+        for page in pages:
+            if ranges and page == ranges[-1][1] + 1:
+                ranges[-1][1] = page
+            else:
+                ranges.append([page, page])
+        label = ", ".join(str(first) if first == last else f"{first}-{last}" for first, last in ranges)
+        return f"{answer}\n\nSources: {'page' if len(pages) == 1 else 'pages'} {label}"
+    
+    def _document_key_terms(self, content: str) -> str:
+        """The document's most characteristic terms, as a query for representative chunks"""
+        return " ".join(self._chunk_state(content)["retriever"].lexical.key_terms())
+    
+    def _search_text(self, text: str, query: str, k: int) -> List[str]:
+        """
+        Chunks of ad-hoc text, such as part of a prompt, that best match query.
+        BM25 only, and nothing is kept: the document index cache is for documents.
+        """
+        chunks = ChunkIndex.build(text, self.retrieval_chunk_words, self.retrieval_chunk_overlap)
+        return [chunks[chunk_id] for chunk_id, _ in BM25Index.build(chunks).search(query, k)]
+    
+    def _find_relevant_content(self, content: str, question: str, indexed: bool = True) -> str:
+        """
+        Find the sections most relevant to the question. content is a document,
+        searched through its cached indexes, unless indexed is False.
+        """
+        if indexed:
+            chunks = self._chunk_state(content)["chunks"]
+            sections = [chunks[chunk_id] for chunk_id in self.retrieve(content, question, k=10)]
+        else:
+            sections = self._search_text(content, question, k=10)
         
-        # Sort by score and take top 2-3 most relevant paragraphs
-        scored_paragraphs.sort(key=lambda x: x[1], reverse=True)
-        relevant_paras = [p[0] for p in scored_paragraphs[:3] if p[1] > 0]
+        # Take the top 2-3 most relevant sections, skipping fragments too short to help
+        relevant_paras = [section for section in sections if len(section) > 50][:3]
         
         if not relevant_paras:
             return ""
@@ -193,26 +667,10 @@ class AIServices:
         if not question:
             return "I couldn't identify the specific question. Please rephrase your question."
         
-        # Simple content matching
-        question_words = set(re.findall(r'\b\w{3,}\b', question.lower()))
-        content_lower = content.lower()
-        
-        # Find sentences that contain question keywords
-        sentences = re.split(r'[.!?]+', content)
-        relevant_sentences = []
-        
-        for sentence in sentences:
-            sentence_words = set(re.findall(r'\b\w{3,}\b', sentence.lower()))
-            overlap = len(question_words.intersection(sentence_words))
-            if overlap > 0 and len(sentence.strip()) > 20:
-                relevant_sentences.append((sentence.strip(), overlap))
+        top_sections = self._search_text(content, question, k=3)
         
-        # Sort by relevance and take top sentences
-        relevant_sentences.sort(key=lambda x: x[1], reverse=True)
-        
-        if relevant_sentences:
-            top_sentences = [s[0] for s in relevant_sentences[:3]]
-            return f"Based on the document content, here's what I found:\n\n" + "\n\n".join(top_sentences)
+        if top_sections:
+            return f"Based on the document content, here's what I found:\n\n" + "\n\n".join(top_sections)
         else:
             # If no direct matches, provide a general response based on content
             return f"I couldn't find specific information about '{question}' in the document. The document appears to discuss: {self._create_content_summary(content)}"
@@ -231,10 +689,7 @@ class AIServices:
         
         return "Generated questions based on the content:\n\n" + "\n\n".join(questions)
     
-    def summarize_content(self, content: str, length: str = "Medium", style: str = "Academic") -> str:
-        """
-        Generate summary of PDF content
-        """
+    def _summary_prompt(self, length: str, style: str) -> str:
         length_instructions = {
             "Brief": "in 2-3 sentences",
             "Medium": "in 1-2 paragraphs", 
@@ -247,7 +702,7 @@ class AIServices:
             "Bullet Points": "as a structured list of key points"
         }
         
-        prompt = f"""
+        return f"""
         Summarize the following academic content {length_instructions[length]} {style_instructions[style]}.
         
         Focus on:
@@ -257,21 +712,156 @@ class AIServices:
         - Practical applications or implications
         
         Content:
-        {content[:6000]}
+        {CONTENT_SLOT}
         """
+    
+    def _needs_map_reduce(self, content: str, budget: int, hierarchical: Optional[bool]) -> bool:
+        if hierarchical is None:
+            return self.token_counter.count(content) > budget
+        return hierarchical
+    
+    def _finish_summary(self, response: str, content: str, length: str, style: str) -> str:
+        # If using fallback, create a more detailed summary
+        if "This appears to be a request for summarization" in response:
+            return self._create_text_summary(content, length, style)
+        return response
+    
+    def _focused_prompt(self, template: str, content: str, focus: str, max_new_tokens: int) -> str:
+        """template filled with the chunks most relevant to focus, up to the whole content budget"""
+        return self._grounded_prompt(template, content, focus, max_new_tokens, budget=self.context_window)[0]
+    
+    def summarize_content(self, content: str, length: str = "Medium", style: str = "Academic", hierarchical: Optional[bool] = None,
+                          focus: Optional[str] = None) -> str:
+        """
+        Generate summary of PDF content. Documents that don't fit in one prompt
+        are summarized hierarchically (see _map_reduce_summary); pass
+        hierarchical=True/False to force either mode. With a focus (a topic or
+        question), a long document is instead summarized from the chunks most
+        relevant to it.
+        """
+        prompt = self._summary_prompt(length, style)
+        budget = self._content_budget(prompt, max_new_tokens=800)
+        if focus:
+            prompt = self._focused_prompt(prompt, content, focus, max_new_tokens=800)
+        else:
+            if self._needs_map_reduce(content, budget, hierarchical):
+                content = self._map_reduce_summary(content, budget)
+            prompt = self._fill_prompt(prompt, content, max_new_tokens=800)
         
         try:
             response = self._generate_response(prompt, max_length=800)
+            return self._finish_summary(response, content, length, style)
             
-            # If using fallback, create a more detailed summary
-            if "This appears to be a request for summarization" in response:
-                return self._create_text_summary(content, length, style)
-            
-            return response
+        except Exception as e:
+            raise Exception(f"Failed to generate summary: {str(e)}")
+    
+    async def summarize_content_async(self, content: str, length: str = "Medium", style: str = "Academic", hierarchical: Optional[bool] = None,
+                                      focus: Optional[str] = None) -> str:
+        """Async variant of summarize_content"""
+        prompt = self._summary_prompt(length, style)
+        budget = self._content_budget(prompt, max_new_tokens=800)
+        if focus:
+            # Retrieval may first have to index the document, which is CPU-bound
+            # and would stall every other coroutine on the loop
+            prompt = await asyncio.to_thread(self._focused_prompt, prompt, content, focus, 800)
+        else:
+            if self._needs_map_reduce(content, budget, hierarchical):
+                content = await self._map_reduce_summary_async(content, budget)
+            prompt = self._fill_prompt(prompt, content, max_new_tokens=800)
+        
+        try:
+            response = await self._generate_response_async(prompt, max_length=800)
+            return self._finish_summary(response, content, length, style)
             
         except Exception as e:
             raise Exception(f"Failed to generate summary: {str(e)}")
     
+    def _map_reduce_summary(self, content: str, target_budget: int) -> str:
+        """
+        Condense a long document into partial summaries that fit in target_budget tokens.
+        The document is split into token-budgeted sections which are summarized
+        concurrently (map); the partial summaries are then grouped and summarized
+        again (reduce) until they fit in the final summary prompt.
+        """
+        section_budget = self._content_budget(SECTION_SUMMARY_PROMPT, max_new_tokens=400)
+        
+        sections = pack_chunks(content, section_budget, self.token_counter)
+        for _ in range(8):  # Each round shrinks the text; the cap guards against runaway loops
+            partials = self._summarize_sections(sections)
+            
+            combined = "\n\n".join(partials)
+            if self.token_counter.count(combined) <= target_budget or len(partials) == 1:
+                return combined
+            sections = self._group_by_budget(partials, section_budget)
+        return truncate_to_budget(combined, target_budget, self.token_counter)
+    
+    async def _map_reduce_summary_async(self, content: str, target_budget: int) -> str:
+        """_map_reduce_summary with sections summarized as concurrent coroutines"""
+        section_budget = self._content_budget(SECTION_SUMMARY_PROMPT, max_new_tokens=400)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        sections = pack_chunks(content, section_budget, self.token_counter)
+        for _ in range(8):
+            partials = await asyncio.gather(*(self._summarize_section_async(section, semaphore) for section in sections))
+            
+            combined = "\n\n".join(partials)
+            if self.token_counter.count(combined) <= target_budget or len(partials) == 1:
+                return combined
+            sections = self._group_by_budget(partials, section_budget)
+        return truncate_to_budget(combined, target_budget, self.token_counter)
+    
+    def _section_key(self, section: str) -> tuple:
+        return (self.model_name, hashlib.sha256(section.encode('utf-8')).hexdigest())
+    
+    def _summarize_sections(self, sections: List[str]) -> List[str]:
+        """Summarize sections in one batch, reusing cached results for identical text"""
+        keys = [self._section_key(section) for section in sections]
+        partials = [self._section_summary_cache.get(key) for key in keys]
+        missing = [index for index, partial in enumerate(partials) if partial is None]
+        results = self.generate_batch(
+            [SECTION_SUMMARY_PROMPT.replace(CONTENT_SLOT, sections[index]) for index in missing],
+            {"max_new_tokens": 400}
+        )
+        for index, result in zip(missing, results):
+            if result["error"] is not None:
+                print(f"API error summarizing section, using extractive summary: {result['error']}")
+                partials[index] = self._create_text_summary(sections[index], "Medium", "Academic")  # Not cached so a retry can use the model
+            else:
+                partials[index] = result["text"]
+                self._section_summary_cache.put(keys[index], result["text"])
+        return partials
+    
+    async def _summarize_section_async(self, section: str, semaphore: asyncio.Semaphore) -> str:
+        key = self._section_key(section)
+        cached = self._section_summary_cache.get(key)
+        if cached is not None:
+            return cached
+        
+        try:
+            async with semaphore:
+                summary = await self._call_model_async(SECTION_SUMMARY_PROMPT.replace(CONTENT_SLOT, section), max_length=400)
+        except Exception as e:
+            print(f"API error summarizing section, using extractive summary: {e}")
+            return self._create_text_summary(section, "Medium", "Academic")
+        
+        self._section_summary_cache.put(key, summary)
+        return summary
+    
+    def _group_by_budget(self, texts: List[str], budget: int) -> List[str]:
+        """Join consecutive texts into groups of at most budget tokens"""
+        groups = []
+        current, current_tokens = [], 0
+        for text in texts:
+            tokens = self.token_counter.count(text)
+            if current and current_tokens + tokens > budget:
+                groups.append("\n\n".join(current))
+                current, current_tokens = [], 0
+            current.append(text)
+            current_tokens += tokens
+        if current:
+            groups.append("\n\n".join(current))
+        return groups
+    
     def _create_text_summary(self, content: str, length: str, style: str) -> str:
         """Create a basic text summary using simple text processing"""
         sentences = re.split(r'[.!?]+', content)
@@ -293,25 +883,88 @@ class AIServices:
         
         return summary + "."
     
-    def translate(self, content: str, target_language: str) -> str:
-        """Translate content to the target language using a dedicated prompt."""
-        if not content or not content.strip():
-            return "Error: Cannot translate empty content."
-
+    def _plan_translation(self, content: str, target_language: str) -> tuple:
+        """Prompt, paragraph-aligned segments, their cache keys and the completion size for a translation"""
         prompt = f"""Translate the following academic text into {target_language}. Provide ONLY the translated text, without any additional comments, headers, or explanations. The translation should be accurate, fluent, and maintain the original tone and style of the academic text.
 
     **Text to Translate:**
-    {content}
+    {CONTENT_SLOT}
     """
 
-        try:
-            translated_text = self._generate_response(prompt, max_length=4096)
-            # Relax the validation to be more forgiving for concise languages
-            if not translated_text or len(translated_text) < 10:
-                return self._fallback_processing(f"translate to {target_language}: content: {content}")
-            return translated_text
-        except Exception as e:
+        # Translations can run longer than their source, so leave the completion
+        # about twice the segment's size
+        overhead = self.context_window - self._content_budget(prompt, max_new_tokens=0)
+        segment_budget = max(1, min(self.translation_segment_tokens, (self.context_window - overhead) // 3))
+        
+        segments = pack_chunks(content, segment_budget, self.token_counter)
+        keys = [(self.model_name, hashlib.sha256(segment.encode('utf-8')).hexdigest(), target_language) for segment in segments]
+        return prompt, segments, keys, segment_budget * 2
+    
+    def _finish_translation(self, content: str, target_language: str, translations: List[Optional[str]]) -> str:
+        if any(translated is None for translated in translations):
+            # Segments translated so far stay cached, so trying again only pays for the rest
             return self._fallback_processing(f"translate to {target_language}: content: {content}")
+        return "\n\n".join(translations)
+    
+    def translate(self, content: str, target_language: str, max_concurrency: Optional[int] = None, max_retries: int = 2) -> str:
+        """
+        Translate content to the target language. The text is split into
+        paragraph-aligned segments that are translated concurrently and
+        reassembled in order; only failed segments are retried, and translated
+        segments are cached so re-translating a revised document only pays for
+        the paragraphs that changed.
+        """
+        if not content or not content.strip():
+            return "Error: Cannot translate empty content."
+
+        prompt, segments, keys, max_new_tokens = self._plan_translation(content, target_language)
+        translations = [self._translation_cache.get(key) for key in keys]
+        
+        for _ in range(1 + max_retries):
+            pending = [index for index, translated in enumerate(translations) if translated is None]
+            if not pending:
+                break
+            results = self.generate_batch(
+                [prompt.replace(CONTENT_SLOT, segments[index]) for index in pending],
+                {"max_new_tokens": max_new_tokens},
+                max_concurrency
+            )
+            for index, result in zip(pending, results):
+                if result["error"] is not None:
+                    print(f"Translation of segment {index + 1}/{len(segments)} failed: {result['error']}")
+                elif result["text"].strip():
+                    translations[index] = result["text"]
+                    self._translation_cache.put(keys[index], result["text"])
+        
+        return self._finish_translation(content, target_language, translations)
+    
+    async def translate_async(self, content: str, target_language: str, max_concurrency: Optional[int] = None, max_retries: int = 2) -> str:
+        """Async variant of translate"""
+        if not content or not content.strip():
+            return "Error: Cannot translate empty content."
+
+        prompt, segments, keys, max_new_tokens = self._plan_translation(content, target_language)
+        translations = [self._translation_cache.get(key) for key in keys]
+        semaphore = asyncio.Semaphore(max_concurrency or self.max_concurrency)
+        
+        async def translate_segment(index: int) -> None:
+            try:
+                async with semaphore:
+                    translated = await self._call_model_async(prompt.replace(CONTENT_SLOT, segments[index]), max_length=max_new_tokens)
+            except Exception as e:
+                print(f"Translation of segment {index + 1}/{len(segments)} failed: {e}")
+                return
+            if translated.strip():
+                translations[index] = translated
+                self._translation_cache.put(keys[index], translated)
+        
+        for _ in range(1 + max_retries):
+            pending = [index for index, translated in enumerate(translations) if translated is None]
+            if not pending:
+                break
+            await asyncio.gather(*(translate_segment(index) for index in pending))
+        
+        return self._finish_translation(content, target_language, translations)
 
     def extract_key_points(self, content: str) -> str:
         """
@@ -326,9 +979,11 @@ class AIServices:
         - Conclusions or implications
         
         Content:
-        {content[:8000]}
+        {CONTENT_SLOT}
         """
         
+        prompt = self._fill_prompt(prompt, content, max_new_tokens=600)
+        
         try:
             response = self._generate_response(prompt, max_length=600)
             
@@ -366,10 +1021,7 @@ class AIServices:
         
         return '\n'.join(key_points)
     
-    def extract_topics(self, content: str, num_topics: int = 8, topic_type: str = "Main Themes") -> List[Dict[str, Any]]:
-        """
-        Extract topics from PDF content
-        """
+    def _topics_prompt(self, num_topics: int, topic_type: str) -> str:
         type_instructions = {
             "Main Themes": "broad thematic areas and overarching concepts",
             "Key Concepts": "specific important concepts and definitions", 
@@ -377,7 +1029,7 @@ class AIServices:
             "Study Points": "important points for studying and exam preparation"
         }
         
-        prompt = f"""
+        return f"""
         Analyze the following academic content and identify {num_topics} {type_instructions[topic_type]}.
         
         For each topic, provide:
@@ -389,23 +1041,42 @@ class AIServices:
         Format each topic clearly with title, description, key points, and relevance.
         
         Content:
-        {content[:6000]}
+        {CONTENT_SLOT}
         """
+    
+    def _finish_topics(self, response: str, content: str, num_topics: int, topic_type: str) -> List[Dict[str, Any]]:
+        # If using fallback, create structured topics from content
+        if "This is a topic extraction request" in response:
+            return self._extract_topics_from_text(content, num_topics, topic_type)
+        
+        # Parse the response into structured format
+        return self._parse_topics_response(response, num_topics)
+    
+    def extract_topics(self, content: str, num_topics: int = 8, topic_type: str = "Main Themes") -> List[Dict[str, Any]]:
+        """
+        Extract topics from PDF content
+        """
+        prompt = self._fill_prompt(self._topics_prompt(num_topics, topic_type), content, max_new_tokens=1200)
         
         try:
             response = self._generate_response(prompt, max_length=1200)
-            
-            # If using fallback, create structured topics from content
-            if "This is a topic extraction request" in response:
-                return self._extract_topics_from_text(content, num_topics, topic_type)
-            
-            # Parse the response into structured format
-            return self._parse_topics_response(response, num_topics)
+            return self._finish_topics(response, content, num_topics, topic_type)
                 
         except Exception as e:
             # Fallback to simple text processing
             return self._extract_topics_from_text(content, num_topics, topic_type)
     
+    async def extract_topics_async(self, content: str, num_topics: int = 8, topic_type: str = "Main Themes") -> List[Dict[str, Any]]:
+        """Async variant of extract_topics"""
+        prompt = self._fill_prompt(self._topics_prompt(num_topics, topic_type), content, max_new_tokens=1200)
+        
+        try:
+            response = await self._generate_response_async(prompt, max_length=1200)
+            return self._finish_topics(response, content, num_topics, topic_type)
+                
+        except Exception as e:
+            return self._extract_topics_from_text(content, num_topics, topic_type)
+    
     def _extract_topics_from_text(self, content: str, num_topics: int, topic_type: str) -> List[Dict[str, Any]]:
         """Extract topics using basic text analysis"""
         # Split content into sentences and paragraphs
@@ -467,10 +1138,7 @@ class AIServices:
         
         return topics[:num_topics]
     
-    def answer_question(self, content: str, question: str) -> str:
-        """
-        Answer questions about the PDF content with improved question handling
-        """
+    def _question_prompt(self, question: str) -> str:
         # Pre-process the question to understand its type
         question_lower = question.lower()
         
@@ -484,7 +1152,7 @@ class AIServices:
         else:
             instruction = "Provide a comprehensive answer based on the content."
         
-        prompt = f"""
+        return f"""
         You are an AI assistant analyzing academic content. Please answer the following question:
         
         Question: {question}
@@ -497,38 +1165,135 @@ class AIServices:
         - Include relevant details, examples, or quotes from the content
         - Be specific and avoid vague or generic responses
         - Maintain an academic tone
+        - If the content is given as excerpts labelled with page numbers, cite the pages you use, e.g. (p. 4)
         
         Content:
-        {content[:6000]}
+        {CONTENT_SLOT}
         
         Answer the question directly and concisely:
         """
+    
+    def _finish_answer(self, response: str, content: str, question: str) -> str:
+        # If we got a fallback response, try to find relevant content
+        if "This is a question-answering request" in response:
+            relevant_content = self._find_relevant_content(content, question)
+            if relevant_content:
+                return relevant_content
+            return "I couldn't find specific information about your question in the provided content. Please try rephrasing your question or check if the topic is covered in the document."
+        
+        # Clean up the response
+        response = response.strip()
+        if response.startswith('"') and response.endswith('"'):
+            response = response[1:-1]
+        
+        return response
+    
+    def _answer_offline(self, content: str, question: str) -> str:
+        """Answer without the model: the document sections that best match the question"""
+        return self._find_relevant_content(content, question) or "I encountered an error while processing your question. Please try again."
+    
+    def _question_cache(self, content: str) -> QuestionCache:
+        """Answers to earlier questions about this document, reused for rephrasings"""
+        state = self._document_state(content)
+        if "question_cache" not in state:
+            state["question_cache"] = QuestionCache.for_document(content)
+        return state["question_cache"]
+    
+    def _cached_answer(self, cache: QuestionCache, question: str) -> Optional[str]:
+        match = cache.lookup(question)
+        if match is None:
+            return None
+        print(f"Answering '{question}' from cached question '{match['matched_question']}' (similarity {match['similarity']:.2f})")
+        return match["answer"]
+    
+    def answer_question(self, content: str, question: str, page_offsets: Optional[List[Tuple[int, int]]] = None) -> str:
+        """
+        Answer questions about the PDF content with improved question handling.
+        Long documents are answered from the chunks most relevant to the question,
+        and the answer cites their pages when page_offsets is given. Rephrasings of
+        a question already answered for this document are served from a cache.
+        """
+        question_cache = self._question_cache(content)
+        cached = self._cached_answer(question_cache, question)
+        if cached is not None:
+            return cached
+        
+        prompt, pages = self._grounded_prompt(self._question_prompt(question), content, question, 1000, page_offsets)
         
         try:
-            response = self._generate_response(prompt, max_length=1000)
-            
-            # If we got a fallback response, try to find relevant content
-            if "This is a question-answering request" in response:
-                relevant_content = self._find_relevant_content(content, question)
-                if relevant_content:
-                    return relevant_content
-                return "I couldn't find specific information about your question in the provided content. Please try rephrasing your question or check if the topic is covered in the document."
-            
-            # Clean up the response
-            response = response.strip()
-            if response.startswith('"') and response.endswith('"'):
-                response = response[1:-1]
-            
-            return response
-            
+            answer = self._finish_answer(self._call_model(prompt, max_length=1000), content, question)
         except Exception as e:
-            print(f"Error in answer_question: {str(e)}")
-            return self._find_relevant_content(content, question) or "I encountered an error while processing your question. Please try again."
+            # The rule-based fallback would only see the prompt, so search the
+            # document itself for the answer instead
+            print(f"API error, answering from the document: {str(e)}")
+            return self._answer_offline(content, question)
+        
+        if answer:
+            answer = self._cite_pages(answer, pages)
+            question_cache.add(question, answer)
+        return answer
     
-    def generate_test(self, content: str, question_count: int = 10, question_type: str = "Multiple Choice", difficulty: str = "Medium") -> List[Dict[str, Any]]:
+    def stream_answer(self, content: str, question: str, page_offsets: Optional[List[Tuple[int, int]]] = None) -> Iterator[str]:
         """
-        Generate test questions based on PDF content
+        answer_question that yields the answer as the model generates it, for
+        rendering incrementally (e.g. with st.write_stream)
         """
+        question_cache = self._question_cache(content)
+        cached = self._cached_answer(question_cache, question)
+        if cached is not None:
+            yield cached
+            return
+        
+        prompt, pages = self._grounded_prompt(self._question_prompt(question), content, question, 1000, page_offsets)
+        
+        pieces = []
+        complete = False
+        try:
+            for piece in self._stream_model(prompt, max_length=1000):
+                pieces.append(piece)
+                yield piece
+            complete = True
+        except Exception as e:
+            if not pieces:
+                # Nothing shown yet. The request was already retried, so calling the model
+                # again without streaming would only make the user wait through it twice
+                print(f"API streaming error, answering from the document: {e}")
+                yield self._answer_offline(content, question)
+                return
+            print(f"API stream interrupted: {e}")
+        
+        answer = "".join(pieces).strip()
+        if answer:
+            cited = self._cite_pages(answer, pages)
+            if pages:
+                yield cited[len(answer):]
+            if complete:
+                question_cache.add(question, cited)
+    
+    async def answer_question_async(self, content: str, question: str, page_offsets: Optional[List[Tuple[int, int]]] = None) -> str:
+        """Async variant of answer_question"""
+        # Fitting the question cache and indexing the document are CPU-bound, so
+        # they run on a worker thread rather than the event loop
+        question_cache = await asyncio.to_thread(self._question_cache, content)
+        cached = self._cached_answer(question_cache, question)
+        if cached is not None:
+            return cached
+        
+        prompt, pages = await asyncio.to_thread(self._grounded_prompt, self._question_prompt(question), content,
+                                                question, 1000, page_offsets)
+        
+        try:
+            answer = self._finish_answer(await self._call_model_async(prompt, max_length=1000), content, question)
+        except Exception as e:
+            print(f"API error, answering from the document: {str(e)}")
+            return await asyncio.to_thread(self._answer_offline, content, question)
+        
+        if answer:
+            answer = self._cite_pages(answer, pages)
+            question_cache.add(question, answer)
+        return answer
+    
+    def _test_prompt(self, question_count: int, question_type: str, difficulty: str) -> str:
         difficulty_instructions = {
             "Easy": "basic recall and understanding questions",
             "Medium": "application and analysis questions",
@@ -543,7 +1308,7 @@ class AIServices:
             "Mixed": "a mix of multiple choice, short answer, and essay questions"
         }
         
-        prompt = f"""
+        return f"""
         Generate {question_count} {type_instructions[question_type]} based on the following academic content.
         Make them {difficulty_instructions[difficulty]}.
         
@@ -559,23 +1324,50 @@ class AIServices:
         - Explanation of what makes a good answer
         
         Content:
-        {content[:5000]}
+        {CONTENT_SLOT}
+        """
+    
+    def _finish_test(self, response: str, content: str, question_count: int, question_type: str, difficulty: str) -> List[Dict[str, Any]]:
+        # If using fallback, generate basic questions
+        if "This is a test generation request" in response:
+            return self._generate_basic_questions(content, question_count, question_type, difficulty)
+        
+        # Parse response into structured questions
+        return self._parse_questions_response(response, question_count, question_type)
+    
+    def generate_test(self, content: str, question_count: int = 10, question_type: str = "Multiple Choice", difficulty: str = "Medium",
+                      focus: Optional[str] = None) -> List[Dict[str, Any]]:
         """
+        Generate test questions based on PDF content. When the document doesn't
+        fit in one prompt, questions are drawn from the chunks most relevant to
+        focus, or to the document's key terms if no focus is given.
+        """
+        prompt = self._focused_prompt(self._test_prompt(question_count, question_type, difficulty), content,
+                                      focus or self._document_key_terms(content), max_new_tokens=1500)
         
         try:
             response = self._generate_response(prompt, max_length=1500)
-            
-            # If using fallback, generate basic questions
-            if "This is a test generation request" in response:
-                return self._generate_basic_questions(content, question_count, question_type, difficulty)
-            
-            # Parse response into structured questions
-            return self._parse_questions_response(response, question_count, question_type)
+            return self._finish_test(response, content, question_count, question_type, difficulty)
                 
         except Exception as e:
             # Fallback to basic question generation
             return self._generate_basic_questions(content, question_count, question_type, difficulty)
     
+    async def generate_test_async(self, content: str, question_count: int = 10, question_type: str = "Multiple Choice", difficulty: str = "Medium",
+                                  focus: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Async variant of generate_test"""
+        # Key terms and retrieval index the document, off the event loop
+        focus = focus or await asyncio.to_thread(self._document_key_terms, content)
+        prompt = await asyncio.to_thread(self._focused_prompt, self._test_prompt(question_count, question_type, difficulty),
+                                         content, focus, 1500)
+        
+        try:
+            response = await self._generate_response_async(prompt, max_length=1500)
+            return self._finish_test(response, content, question_count, question_type, difficulty)
+                
+        except Exception as e:
+            return self._generate_basic_questions(content, question_count, question_type, difficulty)
+    
     def _generate_basic_questions(self, content: str, question_count: int, question_type: str, difficulty: str) -> List[Dict[str, Any]]:
         """Generate basic questions using text analysis"""
         sentences = re.split(r'[.!?]+', content)
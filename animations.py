@@ -1,5 +1,5 @@
 import streamlit as st
-import time
+from contextlib import contextmanager
 
 def load_css():
     """Load custom CSS for animations and styling"""
@@ -485,8 +485,12 @@ def create_animated_header(title: str, subtitle: str):
     </div>
     """, unsafe_allow_html=True)
 
+@contextmanager
 def show_loading_animation(message: str):
-    """Show a loading animation with custom message"""
+    """
+    Show a loading animation with custom message while the body of the with
+    block runs. The animation is pure CSS, so it costs nothing beyond the work.
+    """
     loading_placeholder = st.empty()
     
     loading_placeholder.markdown(f"""
@@ -496,8 +500,10 @@ def show_loading_animation(message: str):
     </div>
     """, unsafe_allow_html=True)
     
-    time.sleep(2)  # Simulate processing time
-    loading_placeholder.empty()
+    try:
+        yield
+    finally:
+        loading_placeholder.empty()
 
 def create_animated_card(content: str, card_type: str = "result"):
     """Create an animated card with content"""
@@ -1,13 +1,14 @@
 import streamlit as st
-import time
 import json
 import re
 import os
 from dotenv import load_dotenv
 
 # Update import paths to match the project structure
-from pdf_processor import PDFProcessor
+from pdf_processor import PDFProcessor, join_pages
 from ai_services import AIServices
+from caching import LRUCache, hash_content
+from jobs import JobRunner, DONE, FAILED
 from animations import load_css, create_animated_header, show_loading_animation
 
 # Load environment variables
@@ -33,13 +34,27 @@ def initialize_services():
         st.error(f"Failed to initialize services: {str(e)}")
         st.stop()
 
+# Per-session cap on remembered analysis results
+SESSION_RESULTS_BYTES = int(os.getenv("STUDYMATE_SESSION_RESULTS_MB", "8")) * 1024 * 1024
+
+# How long a rerun waits on a background job before refreshing its status
+JOB_POLL_SECONDS = 1.0
+
+# One job pool for the whole server, so jobs outlive the script run that started them
+@st.cache_resource
+def initialize_job_runner():
+    return JobRunner()
+
 # Initialize session state with default values
 def init_session_state():
     defaults = {
         'pdf_content': "",
+        'pdf_hash': "",
         'pdf_filename': "",
+        'pdf_page_offsets': [],
         'chat_history': [],
-        'processed_content': {},
+        'jobs': {},
+        'processed_content': LRUCache(max_entries=64, max_bytes=SESSION_RESULTS_BYTES),
         'current_page': "upload"
     }
     for key, value in defaults.items():
@@ -51,10 +66,87 @@ init_session_state()
 
 try:
     pdf_processor, ai_services = initialize_services()
+    job_runner = initialize_job_runner()
 except Exception as e:
     st.error(f"Application initialization failed: {str(e)}")
     st.stop()
 
+def _result_key(action, options):
+    return (st.session_state.pdf_hash, action, tuple(sorted(options.items())))
+
+def get_processed_result(action, options):
+    """Result of an earlier run of action on the current document with the same options, if kept"""
+    return st.session_state.processed_content.get(_result_key(action, options))
+
+def store_processed_result(action, options, result):
+    st.session_state.processed_content.put(_result_key(action, options), result)
+
+def _session_job(key):
+    job_id = st.session_state.jobs.get(key)
+    return job_runner.get(job_id) if job_id else None
+
+def _forget_job(key):
+    job_id = st.session_state.jobs.pop(key, None)
+    if job_id:
+        job_runner.discard(job_id)
+
+def start_job(action, options, function, *args, **kwargs):
+    """Run function in the background unless a job for the same action and options is already running"""
+    key = _result_key(action, options)
+    job = _session_job(key)
+    if job is None or not job.active:
+        st.session_state.jobs[key] = job_runner.submit(action, function, *args, **kwargs)
+
+def job_result(action, options):
+    """Kept result for action and options, collecting it from a finished background job first"""
+    result = get_processed_result(action, options)
+    if result is not None:
+        return result
+    key = _result_key(action, options)
+    job = _session_job(key)
+    if job is None or job.status != DONE:
+        return None
+    store_processed_result(action, options, job.result)
+    _forget_job(key)
+    return job.result
+
+def show_job_status(action, options, label, error_message):
+    """
+    Show the state of the background job for action and options, with a cancel
+    button while it runs. Waits briefly on a running job, then reruns the script
+    to poll again; returns only when there is no job in progress.
+    """
+    key = _result_key(action, options)
+    job = _session_job(key)
+    if job is None:
+        st.session_state.jobs.pop(key, None)
+        return
+    if job.status == FAILED:
+        st.error(f"{error_message}: {job.error}")
+        _forget_job(key)
+        return
+    if not job.active:
+        if job.status == DONE:
+            st.rerun()  # Finished since job_result looked
+        _forget_job(key)
+        return
+
+    col1, col2 = st.columns([4, 1])
+    with col1:
+        if job.started:
+            st.caption(f"⏳ {label}... {int(job.elapsed())}s elapsed. You can leave this page; the result will be waiting.")
+        else:
+            st.caption("⏳ Waiting for a free worker...")
+    with col2:
+        if st.button("✖️ Cancel", key=f"cancel_{action}", use_container_width=True):
+            job_runner.cancel(job.id)
+            _forget_job(key)
+            st.rerun()
+
+    with show_loading_animation(label):
+        job_runner.wait(job.id, JOB_POLL_SECONDS)
+    st.rerun()
+
 def apply_styling():
     st.markdown("""<style>
     @import url('https://fonts.googleapis.com/css2?family=Inter:wght@300;400;500;600;700&display=swap');
@@ -642,16 +734,24 @@ def handle_translation():
             # Only trigger translation if the language changes
             if st.button(lang, key=f"lang_{lang}", use_container_width=True):
                 if st.session_state.get("translated_lang") != lang:
-                    with st.spinner(f"Translating to {lang}, please wait..."):
-                        full_text = st.session_state.get("pdf_content", "")
-                        if full_text:
-                            ai = AIServices()
-                            translated_content = ai.translate(full_text, lang)
-                            st.session_state.translated_text = translated_content
-                            st.session_state.translated_lang = lang
-                        else:
-                            st.session_state.translated_text = "Error: PDF content not found."
-                    st.rerun()
+                    full_text = st.session_state.get("pdf_content", "")
+                    if full_text:
+                        start_job("translate", {"language": lang}, ai_services.translate, full_text, lang)
+                        st.session_state.translating_lang = lang
+                    else:
+                        st.session_state.translated_text = "Error: PDF content not found."
+
+    # Pick up the translation once its background job is done
+    pending_lang = st.session_state.get("translating_lang")
+    if pending_lang:
+        translated_content = job_result("translate", {"language": pending_lang})
+        if translated_content is not None:
+            st.session_state.translated_text = translated_content
+            st.session_state.translated_lang = pending_lang
+            del st.session_state.translating_lang
+        else:
+            show_job_status("translate", {"language": pending_lang}, f"Translating to {pending_lang}", "❌ Error translating")
+            del st.session_state.translating_lang
 
     # Display translation result and download button
     if "translated_text" in st.session_state:
@@ -702,6 +802,9 @@ def main():
             </div>
             """, unsafe_allow_html=True)
             
+            if ai_services.endpoint_status()["circuit"]["state"] != "closed":
+                st.warning("⚠️ The AI model is not responding, so results come from quick offline analysis for now.")
+            
             # Button to change document
             if st.button("📤 Upload New Document", use_container_width=True):
                 st.session_state.current_page = "upload"
@@ -835,29 +938,44 @@ def handle_pdf_upload():
                 progress_bar = st.progress(0)
                 status_text = st.empty()
                 
+                preview_placeholder = st.empty()
+                
                 status_text.text("📖 Extracting text...")
-                progress_bar.progress(25)
+                total_pages = max(pdf_processor.count_pages(uploaded_file), 1)
                 
-                text_content = pdf_processor.extract_text(uploaded_file)
+                # Drive the progress bar from real page extraction and show the
+                # first pages as soon as they are ready
+                pages = []
+                for page_number, page_text in pdf_processor.iter_pages(uploaded_file):
+                    pages.append((page_number, page_text))
+                    progress_bar.progress(min(page_number / total_pages, 1.0))
+                    status_text.text(f"📖 Extracted page {page_number} of {total_pages}...")
+                    if len(pages) <= 3:
+                        preview_placeholder.text_area(
+                            "Early Preview",
+                            "\n\n".join(text for _, text in pages)[:1200],
+                            height=200,
+                            disabled=True
+                        )
                 
-                status_text.text("🧠 Processing content...")
-                progress_bar.progress(75)
-                time.sleep(0.5)  # Smooth animation
+                # Keep page start offsets so chunks can be traced back to pages
+                text_content, page_offsets = join_pages(pages)
+                preview_placeholder.empty()
+                
+                # Build the search index now so the first question doesn't wait for it
+                status_text.text("🔎 Indexing document...")
+                ai_services.index_document(text_content, page_offsets)
                 
                 st.session_state.pdf_content = text_content
+                st.session_state.pdf_hash = hash_content(text_content.encode('utf-8'))
+                st.session_state.pdf_page_offsets = page_offsets
                 st.session_state.pdf_filename = uploaded_file.name
                 st.session_state.current_page = "main"  # Switch to main action menu
                 
-                status_text.text("✅ Processing complete!")
-                progress_bar.progress(100)
-                
-                time.sleep(1)
                 status_text.empty()
                 progress_bar.empty()
                 
-                # Show success message and rerun to show action menu
-                st.success("🎉 Document processed successfully! Action menu will appear below.")
-                time.sleep(1)
+                # The action menu confirms the upload, so go straight to it
                 st.rerun()
                 
                 st.markdown(f"""
@@ -915,39 +1033,41 @@ def handle_summarization():
             key="summary_style"
         )
     
-    if st.button("🚀 Generate Summary", use_container_width=True):
-        with st.spinner("🤖 AI is analyzing your document..."):
-            show_loading_animation("Generating summary")
+    options = {"length": summary_length, "style": summary_style}
+    summary = job_result("summary", options)
+    
+    # The model runs in the background; reruns poll it until the result is in
+    if st.button("🚀 Generate Summary", use_container_width=True) and summary is None:
+        start_job("summary", options, ai_services.summarize_content,
+                  st.session_state.pdf_content, length=summary_length, style=summary_style)
+    
+    if summary is None:
+        show_job_status("summary", options, "Generating summary", "❌ Error generating summary")
+        return
+    
+    try:
+        # Animated result display
+        st.markdown("### ✨ Summary Generated!")
+        
+        with st.container():
+            st.markdown("""
+            <div class="result-card">
+            """, unsafe_allow_html=True)
             
-            try:
-                summary = ai_services.summarize_content(
-                    st.session_state.pdf_content,
-                    length=summary_length,
-                    style=summary_style
-                )
-                
-                # Animated result display
-                st.markdown("### ✨ Summary Generated!")
-                
-                with st.container():
-                    st.markdown("""
-                    <div class="result-card">
-                    """, unsafe_allow_html=True)
-                    
-                    st.markdown(summary)
-                    
-                    st.markdown("</div>", unsafe_allow_html=True)
-                
-                # Download option
-                st.download_button(
-                    label="📥 Download Summary",
-                    data=summary,
-                    file_name=f"summary_{st.session_state.pdf_filename}.txt",
-                    mime="text/plain"
-                )
-                
-            except Exception as e:
-                st.error(f"❌ Error generating summary: {str(e)}")
+            st.markdown(summary)
+            
+            st.markdown("</div>", unsafe_allow_html=True)
+        
+        # Download option
+        st.download_button(
+            label="📥 Download Summary",
+            data=summary,
+            file_name=f"summary_{st.session_state.pdf_filename}.txt",
+            mime="text/plain"
+        )
+        
+    except Exception as e:
+        st.error(f"❌ Error generating summary: {str(e)}")
 
 def handle_topic_extraction():
     st.markdown("## 🏷️ Key Topic Extraction")
@@ -974,54 +1094,55 @@ def handle_topic_extraction():
             key="topic_type"
         )
     
-    if st.button("🔍 Extract Topics", use_container_width=True):
-        with st.spinner("🧠 Analyzing document structure..."):
-            show_loading_animation("Extracting topics")
+    options = {"num_topics": num_topics, "topic_type": topic_type}
+    topics = job_result("topics", options)
+    
+    if st.button("🔍 Extract Topics", use_container_width=True) and topics is None:
+        start_job("topics", options, ai_services.extract_topics,
+                  st.session_state.pdf_content, num_topics=num_topics, topic_type=topic_type)
+    
+    if topics is None:
+        show_job_status("topics", options, "Extracting topics", "❌ Error extracting topics")
+        return
+    
+    try:
+        st.markdown("### 🎯 Topics Extracted!")
+        
+        # Display topics with animations
+        for i, topic in enumerate(topics, 1):
+            with st.expander(f"📌 Topic {i}: {topic['title']}", expanded=True):
+                st.markdown(f"**Description:** {topic['description']}")
+                st.markdown(f"**Key Points:**")
+                for point in topic['key_points']:
+                    st.markdown(f"• {point}")
+                st.markdown(f"**Relevance:** {topic['relevance']}")
+        
+        # Export options
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            topics_text = "\n".join([f"{i}. {topic['title']}\n{topic['description']}\nKey Points:\n" + 
+                                   "\n".join([f"- {point}" for point in topic['key_points']]) + f"\nRelevance: {topic['relevance']}\n"
+                                   for i, topic in enumerate(topics, 1)])
             
-            try:
-                topics = ai_services.extract_topics(
-                    st.session_state.pdf_content,
-                    num_topics=num_topics,
-                    topic_type=topic_type
-                )
-                
-                st.markdown("### 🎯 Topics Extracted!")
-                
-                # Display topics with animations
-                for i, topic in enumerate(topics, 1):
-                    with st.expander(f"📌 Topic {i}: {topic['title']}", expanded=True):
-                        st.markdown(f"**Description:** {topic['description']}")
-                        st.markdown(f"**Key Points:**")
-                        for point in topic['key_points']:
-                            st.markdown(f"• {point}")
-                        st.markdown(f"**Relevance:** {topic['relevance']}")
-                
-                # Export options
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    topics_text = "\n".join([f"{i}. {topic['title']}\n{topic['description']}\nKey Points:\n" + 
-                                           "\n".join([f"- {point}" for point in topic['key_points']]) + f"\nRelevance: {topic['relevance']}\n"
-                                           for i, topic in enumerate(topics, 1)])
-                    
-                    st.download_button(
-                        label="📥 Download Topics (TXT)",
-                        data=topics_text,
-                        file_name=f"topics_{st.session_state.pdf_filename}.txt",
-                        mime="text/plain"
-                    )
-                
-                with col2:
-                    topics_json = json.dumps(topics, indent=2)
-                    st.download_button(
-                        label="📥 Download Topics (JSON)",
-                        data=topics_json,
-                        file_name=f"topics_{st.session_state.pdf_filename}.json",
-                        mime="application/json"
-                    )
-                
-            except Exception as e:
-                st.error(f"❌ Error extracting topics: {str(e)}")
+            st.download_button(
+                label="📥 Download Topics (TXT)",
+                data=topics_text,
+                file_name=f"topics_{st.session_state.pdf_filename}.txt",
+                mime="text/plain"
+            )
+        
+        with col2:
+            topics_json = json.dumps(topics, indent=2)
+            st.download_button(
+                label="📥 Download Topics (JSON)",
+                data=topics_json,
+                file_name=f"topics_{st.session_state.pdf_filename}.json",
+                mime="application/json"
+            )
+        
+    except Exception as e:
+        st.error(f"❌ Error extracting topics: {str(e)}")
 
 def handle_test_generation():
     st.markdown("## 📝 Practice Test Generator")
@@ -1059,70 +1180,70 @@ def handle_test_generation():
             key="difficulty"
         )
     
-    if st.button("📝 Generate Test", use_container_width=True):
-        with st.spinner("🎓 Creating your personalized test..."):
-            show_loading_animation("Generating test questions")
-            
-            try:
-                test_questions = ai_services.generate_test(
-                    st.session_state.pdf_content,
-                    question_count=question_count,
-                    question_type=question_type,
-                    difficulty=difficulty
-                )
-                
-                st.markdown("### 🎯 Test Generated!")
-                st.markdown(f"**{question_count} {difficulty.lower()} {question_type.lower()} questions**")
-                
-                # Display questions
-                for i, question in enumerate(test_questions, 1):
-                    with st.expander(f"Question {i}", expanded=False):
-                        st.markdown(f"**{question['question']}**")
-                        
-                        if question['type'] == 'multiple_choice' and 'options' in question:
-                            for j, option in enumerate(question['options'], 1):
-                                st.markdown(f"{chr(64+j)}. {option}")
-                            st.markdown(f"**Correct Answer:** {question.get('correct_answer', 'Not specified')}")
-                        
-                        if 'explanation' in question:
-                            st.markdown(f"**Explanation:** {question['explanation']}")
-                
-                # Export options
-                col1, col2 = st.columns(2)
-                
-                with col1:
-                    # Format for text export
-                    test_text = f"Test Questions - {st.session_state.pdf_filename}\n"
-                    test_text += "="*50 + "\n\n"
-                    
-                    for i, question in enumerate(test_questions, 1):
-                        test_text += f"Question {i}: {question['question']}\n"
-                        if question['type'] == 'multiple_choice' and 'options' in question:
-                            for j, option in enumerate(question['options'], 1):
-                                test_text += f"{chr(64+j)}. {option}\n"
-                            test_text += f"Correct Answer: {question.get('correct_answer', 'Not specified')}\n"
-                        if 'explanation' in question:
-                            test_text += f"Explanation: {question['explanation']}\n"
-                        test_text += "\n" + "-"*30 + "\n\n"
-                    
-                    st.download_button(
-                        label="📥 Download Test (TXT)",
-                        data=test_text,
-                        file_name=f"test_{st.session_state.pdf_filename}.txt",
-                        mime="text/plain"
-                    )
+    options = {"question_count": question_count, "question_type": question_type, "difficulty": difficulty}
+    test_questions = job_result("test", options)
+    
+    if st.button("📝 Generate Test", use_container_width=True) and test_questions is None:
+        start_job("test", options, ai_services.generate_test,
+                  st.session_state.pdf_content, question_count=question_count, question_type=question_type, difficulty=difficulty)
+    
+    if test_questions is None:
+        show_job_status("test", options, "Generating test questions", "❌ Error generating test")
+        return
+    
+    try:
+        st.markdown("### 🎯 Test Generated!")
+        st.markdown(f"**{question_count} {difficulty.lower()} {question_type.lower()} questions**")
+        
+        # Display questions
+        for i, question in enumerate(test_questions, 1):
+            with st.expander(f"Question {i}", expanded=False):
+                st.markdown(f"**{question['question']}**")
                 
-                with col2:
-                    test_json = json.dumps(test_questions, indent=2)
-                    st.download_button(
-                        label="📥 Download Test (JSON)",
-                        data=test_json,
-                        file_name=f"test_{st.session_state.pdf_filename}.json",
-                        mime="application/json"
-                    )
+                if question['type'] == 'multiple_choice' and 'options' in question:
+                    for j, option in enumerate(question['options'], 1):
+                        st.markdown(f"{chr(64+j)}. {option}")
+                    st.markdown(f"**Correct Answer:** {question.get('correct_answer', 'Not specified')}")
                 
-            except Exception as e:
-                st.error(f"❌ Error generating test: {str(e)}")
+                if 'explanation' in question:
+                    st.markdown(f"**Explanation:** {question['explanation']}")
+        
+        # Export options
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            # Format for text export
+            test_text = f"Test Questions - {st.session_state.pdf_filename}\n"
+            test_text += "="*50 + "\n\n"
+            
+            for i, question in enumerate(test_questions, 1):
+                test_text += f"Question {i}: {question['question']}\n"
+                if question['type'] == 'multiple_choice' and 'options' in question:
+                    for j, option in enumerate(question['options'], 1):
+                        test_text += f"{chr(64+j)}. {option}\n"
+                    test_text += f"Correct Answer: {question.get('correct_answer', 'Not specified')}\n"
+                if 'explanation' in question:
+                    test_text += f"Explanation: {question['explanation']}\n"
+                test_text += "\n" + "-"*30 + "\n\n"
+            
+            st.download_button(
+                label="📥 Download Test (TXT)",
+                data=test_text,
+                file_name=f"test_{st.session_state.pdf_filename}.txt",
+                mime="text/plain"
+            )
+        
+        with col2:
+            test_json = json.dumps(test_questions, indent=2)
+            st.download_button(
+                label="📥 Download Test (JSON)",
+                data=test_json,
+                file_name=f"test_{st.session_state.pdf_filename}.json",
+                mime="application/json"
+            )
+        
+    except Exception as e:
+        st.error(f"❌ Error generating test: {str(e)}")
 
 def handle_qa():
     st.markdown("## 💬 PDF Q&A")
@@ -1148,16 +1269,15 @@ def handle_qa():
             st.markdown(prompt)
 
         with st.chat_message("assistant"):
-            message_placeholder = st.empty()
-            with st.spinner("Analyzing document and generating answer..."):
-                full_text = st.session_state.get("pdf_content", "")
-                if full_text:
-                    ai = AIServices()
-                    response = ai.answer_question(full_text, prompt)
-                    message_placeholder.markdown(response)
-                else:
-                    response = "I can't answer questions without a PDF document. Please upload one first."
-                    message_placeholder.markdown(response)
+            full_text = st.session_state.get("pdf_content", "")
+            if full_text:
+                # Render the answer token by token as the model generates it
+                response = st.write_stream(
+                    ai_services.stream_answer(full_text, prompt, st.session_state.get("pdf_page_offsets"))
+                )
+            else:
+                response = "I can't answer questions without a PDF document. Please upload one first."
+                st.markdown(response)
             st.session_state.messages.append({"role": "assistant", "content": response})
 
 if __name__ == "__main__":
@@ -0,0 +1,125 @@
+import os
+from typing import Any, Dict, List, Optional
+
+DEFAULT_MODEL = "ibm-granite/granite-3.1-2b-instruct"
+
+class InferenceBackend:
+    """
+    Wire format of one kind of text-generation server. AIServices describes a
+    request as {"inputs": prompt or list of prompts, "parameters": {...}} in
+    Hugging Face terms; a backend turns that into its own URL and request body,
+    and its responses back into completion texts.
+    """
+    name = ""
+    batch_inputs = False  # Whether one request can carry a list of prompts
+
+    def __init__(self, base_url: str, model_name: str, api_key: Optional[str] = None):
+        self.base_url = base_url.rstrip('/')
+        self.model_name = model_name
+        self.api_key = api_key
+        self.headers = {"Content-Type": "application/json"}
+        if api_key:
+            self.headers["Authorization"] = f"Bearer {api_key}"
+
+    def url(self, stream: bool = False) -> str:
+        raise NotImplementedError
+
+    def body(self, payload: Dict[str, Any], stream: bool = False) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def completions(self, data: Any) -> List[str]:
+        """Completion texts from a JSON response, one per input"""
+        # One entry per input: a generation, or a list holding one
+        items = data if isinstance(data, list) else [data]
+        return [(item[0] if isinstance(item, list) else item)['generated_text'] for item in items]
+
+    def stream_text(self, event: Dict[str, Any]) -> Optional[str]:
+        """Text added by one server-sent event, if any; raises on an error event"""
+        if "error" in event:
+            raise Exception(f"API stream failed: {event['error']}")
+        token = event.get("token") or {}
+        if token.get("special"):
+            return None
+        return token.get("text")
+
+class HuggingFaceBackend(InferenceBackend):
+    """Hugging Face Inference API: POST /models/<model>"""
+    name = "huggingface"
+
+    def url(self, stream: bool = False) -> str:
+        return f"{self.base_url}/models/{self.model_name}"
+
+    def body(self, payload: Dict[str, Any], stream: bool = False) -> Dict[str, Any]:
+        return dict(payload, stream=True) if stream else payload
+
+class TGIBackend(InferenceBackend):
+    """Text Generation Inference server: POST /generate, or /generate_stream for server-sent events"""
+    name = "tgi"
+
+    def url(self, stream: bool = False) -> str:
+        return f"{self.base_url}/generate_stream" if stream else f"{self.base_url}/generate"
+
+    def body(self, payload: Dict[str, Any], stream: bool = False) -> Dict[str, Any]:
+        return {"inputs": payload["inputs"], "parameters": payload["parameters"]}
+
+class OpenAICompletionsBackend(InferenceBackend):
+    """OpenAI-compatible completions API, as served by vLLM and others: POST /v1/completions"""
+    name = "openai"
+    batch_inputs = True
+
+    def __init__(self, base_url: str, model_name: str, api_key: Optional[str] = None):
+        base_url = base_url.rstrip('/')
+        super().__init__(base_url[:-len("/v1")] if base_url.endswith("/v1") else base_url, model_name, api_key)
+
+    def url(self, stream: bool = False) -> str:
+        return f"{self.base_url}/v1/completions"
+
+    def body(self, payload: Dict[str, Any], stream: bool = False) -> Dict[str, Any]:
+        parameters = payload["parameters"]
+        return {
+            "model": self.model_name,
+            "prompt": payload["inputs"],
+            "max_tokens": parameters.get("max_new_tokens", 500),
+            "temperature": parameters.get("temperature", 0.3),
+            "stream": stream,
+        }
+
+    def completions(self, data: Any) -> List[str]:
+        choices = sorted(data["choices"], key=lambda choice: choice.get("index", 0))
+        return [choice["text"] for choice in choices]
+
+    def stream_text(self, event: Dict[str, Any]) -> Optional[str]:
+        if "error" in event:
+            raise Exception(f"API stream failed: {event['error']}")
+        choices = event.get("choices") or []
+        return choices[0].get("text") if choices else None
+
+BACKENDS = {
+    HuggingFaceBackend.name: HuggingFaceBackend,
+    TGIBackend.name: TGIBackend,
+    OpenAICompletionsBackend.name: OpenAICompletionsBackend,
+}
+
+def load_backend(name: Optional[str] = None, base_url: Optional[str] = None, model_name: Optional[str] = None,
+                 api_key: Optional[str] = None) -> InferenceBackend:
+    """
+    The backend chosen by STUDYMATE_BACKEND (huggingface, tgi or openai), at
+    STUDYMATE_BACKEND_URL, serving STUDYMATE_MODEL. The Hugging Face API needs
+    HUGGINGFACE_API_KEY; self-hosted servers take STUDYMATE_API_KEY if they
+    need a key at all.
+    """
+    name = (name or os.getenv("STUDYMATE_BACKEND", HuggingFaceBackend.name)).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{name}'. Choose one of: {', '.join(BACKENDS)}")
+    model_name = model_name or os.getenv("STUDYMATE_MODEL", DEFAULT_MODEL)
+    base_url = base_url or os.getenv("STUDYMATE_BACKEND_URL")
+
+    if name == HuggingFaceBackend.name:
+        api_key = api_key or os.getenv("HUGGINGFACE_API_KEY")
+        if not api_key:
+            raise ValueError("Hugging Face API key not found. Please set HUGGINGFACE_API_KEY in your environment variables.")
+        return HuggingFaceBackend(base_url or "https://api-inference.huggingface.co", model_name, api_key)
+
+    if not base_url:
+        raise ValueError(f"The '{name}' backend needs the server address in STUDYMATE_BACKEND_URL")
+    return BACKENDS[name](base_url, model_name, api_key or os.getenv("STUDYMATE_API_KEY"))
@@ -0,0 +1,218 @@
+"""
+Performance benchmarks for StudyMate AI.
+
+Run with:
+    python benchmarks.py large-document [--pages 250 1000 4000]
+    python benchmarks.py clean-text [--megabytes 1 4 16]
+    python benchmarks.py vector-search [--chunks 10000 100000 300000]
+    python benchmarks.py throughput [--backend tgi] [--prompts 200] [--latency 0.2] [--error-rate 0.05]
+"""
+import os
+import re
+import sys
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+import tracemalloc
+from typing import Callable, List
+
+def make_text_pdf(num_pages: int, words_per_page: int = 250) -> bytes:
+    """Build a minimal text-only PDF with a flat page tree"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(num_pages))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {num_pages} >>".encode())
+    font_id = 3 + 2 * num_pages
+
+    for page in range(num_pages):
+        words = " ".join(f"term{(page * words_per_page + i) % 4999}" for i in range(words_per_page))
+        lines = [f"Chapter {page + 1}."] + [words[i:i + 80] for i in range(0, len(words), 80)]
+        stream = "BT /F1 10 Tf 12 TL 40 800 Td " + " ".join(f"({line}) Tj T*" for line in lines) + " ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                       f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {4 + 2 * page} 0 R >>".encode())
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream".encode())
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    pdf += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(pdf)
+
+def _peak_rss_kb() -> int:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+def _measure_extraction(path: str, large_document: bool) -> None:
+    """Child process: extract every page and report the peak RSS growth"""
+    from pdf_processor import PDFProcessor
+
+    processor = PDFProcessor(max_workers=1, use_cache=False, large_document=large_document)
+    baseline = _peak_rss_kb()
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        store = processor.extract_to_store(f, parallel=False)
+    elapsed = time.perf_counter() - start
+    print(f"{len(store)} {_peak_rss_kb() - baseline} {elapsed:.2f}")
+    store.close()
+
+def bench_large_document(page_counts: List[int]) -> None:
+    """Peak RSS growth of standard vs large-document extraction as page count grows"""
+    print(f"{'pages':>7} {'file MB':>8} {'mode':>9} {'peak RSS +MB':>13} {'seconds':>8}")
+    for num_pages in page_counts:
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+            f.write(make_text_pdf(num_pages))
+        try:
+            file_mb = os.path.getsize(f.name) / 1024 / 1024
+            for mode, large in (("standard", "0"), ("large", "1")):
+                # Fresh interpreter per run so peak RSS isn't inherited from earlier runs
+                output = subprocess.run(
+                    [sys.executable, __file__, "_measure", f.name, large],
+                    capture_output=True, text=True, check=True
+                ).stdout.split()
+                _, rss_kb, seconds = output[-3:]
+                print(f"{num_pages:>7} {file_mb:>8.1f} {mode:>9} {int(rss_kb) / 1024:>13.1f} {seconds:>8}")
+        finally:
+            os.remove(f.name)
+
+def _legacy_clean_text(text: str) -> str:
+    """clean_text as it was before the single-pass normalizer, for comparison"""
+    text = ' '.join(text.split())
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s+([.,;:!?])', r'\1', text)
+    text = re.sub(r'([\w])-\s+([\w])', r'\1\2', text)
+    return text.strip()
+
+def _sample_extracted_text(size: int) -> str:
+    """Text shaped like PyPDF2 output: short lines, hyphenation, stray spaces"""
+    paragraph = (
+        "The experimental results demonstrate that the pro-\nposed method im-\nproves accuracy ,\n"
+        "while  reducing   training time .\nFurther analysis  of the data\tshows consistent\n"
+        "gains across all bench- marks ; see Table 2 for de-\ntails !\n\n"
+    )
+    return paragraph * (size // len(paragraph) + 1)
+
+def _time_and_peak(func: Callable[[str], str], text: str):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(text)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def bench_clean_text(megabytes: List[int]) -> None:
+    """Time and peak allocation of PDFProcessor.clean_text vs the chained-regex version"""
+    from pdf_processor import PDFProcessor
+
+    processor = PDFProcessor(use_cache=False)
+    print(f"{'input MB':>8} {'legacy s':>9} {'single-pass s':>14} {'legacy peak MB':>15} {'single-pass peak MB':>20} {'identical':>10}")
+    for size in megabytes:
+        text = _sample_extracted_text(size * 1024 * 1024)
+        legacy, legacy_seconds, legacy_peak = _time_and_peak(_legacy_clean_text, text)
+        current, current_seconds, current_peak = _time_and_peak(processor.clean_text, text)
+        print(f"{size:>8} {legacy_seconds:>9.3f} {current_seconds:>14.3f} {legacy_peak / 1024 / 1024:>15.1f} "
+              f"{current_peak / 1024 / 1024:>20.1f} {str(legacy == current):>10}")
+
+def bench_vector_search(chunk_counts: List[int], dimension: int = 384, queries: int = 16) -> None:
+    """Latency of VectorIndex top-10 search, for one query and a batch, as the library grows"""
+    import numpy as np
+    from vector_index import VectorIndex
+
+    rng = np.random.default_rng(0)
+    print(f"{'chunks':>8} {'matrix MB':>10} {'1 query ms':>11} {f'{queries} queries ms':>15}")
+    for num_chunks in chunk_counts:
+        index = VectorIndex(dimension, capacity=num_chunks)
+        per_document = 1000
+        for document in range(0, num_chunks, per_document):
+            index.add(f"doc{document}", rng.standard_normal((min(per_document, num_chunks - document), dimension), dtype=np.float32))
+        batch = rng.standard_normal((queries, dimension), dtype=np.float32)
+
+        start = time.perf_counter()
+        index.search(batch[:1], k=10)
+        single = time.perf_counter() - start
+        start = time.perf_counter()
+        index.search(batch, k=10)
+        batched = time.perf_counter() - start
+        print(f"{num_chunks:>8} {num_chunks * dimension * 4 / 1024 / 1024:>10.1f} {single * 1000:>11.1f} {batched * 1000:>15.1f}")
+
+def bench_throughput(backend_name: str, num_prompts: int, latency: float, error_rate: float,
+                     throttle_rate: float, server_concurrency: int) -> None:
+    """
+    Completions per second through AIServices.generate_batch against the local
+    mock server, one at a time and with the configured fan-out or batching
+    """
+    os.environ.setdefault("STUDYMATE_RATE_LIMIT", "0")  # Measure the client, not the default rate cap
+    os.environ.setdefault("HUGGINGFACE_API_KEY", "mock")
+    from mock_server import MockSettings, serve
+    from backends import load_backend
+    from ai_services import AIServices
+
+    settings = MockSettings(latency=latency, error_rate=error_rate, throttle_rate=throttle_rate,
+                            retry_after=0.1, max_concurrency=server_concurrency, seed=0)
+    server = serve(settings, port=0)
+    backend = load_backend(backend_name, base_url=f"http://127.0.0.1:{server.server_port}")
+    services = AIServices(use_response_cache=False, backend=backend)
+
+    print(f"{'mode':>12} {'prompts':>8} {'seconds':>8} {'per second':>11} {'failed':>7} {'requests':>9}")
+    for mode in ("sequential", "concurrent"):
+        prompts = [f"{mode} benchmark prompt {index}" for index in range(num_prompts)]
+        requests_before = settings.stats["requests"]
+        start = time.perf_counter()
+        if mode == "sequential":
+            results = [services.generate_batch([prompt], {"max_new_tokens": 32}, max_concurrency=1)[0] for prompt in prompts]
+        else:
+            results = services.generate_batch(prompts, {"max_new_tokens": 32})
+        seconds = time.perf_counter() - start
+        failed = sum(result["error"] is not None for result in results)
+        print(f"{mode:>12} {num_prompts:>8} {seconds:>8.2f} {num_prompts / seconds:>11.1f} {failed:>7} "
+              f"{settings.stats['requests'] - requests_before:>9}")
+    print(services.endpoint_status())
+    server.shutdown()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="StudyMate AI benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    large = subparsers.add_parser("large-document", help="Peak memory of PDF extraction vs page count")
+    large.add_argument("--pages", type=int, nargs="+", default=[250, 1000, 4000])
+
+    clean = subparsers.add_parser("clean-text", help="Speed and peak memory of PDFProcessor.clean_text")
+    clean.add_argument("--megabytes", type=int, nargs="+", default=[1, 4, 16])
+
+    vectors = subparsers.add_parser("vector-search", help="Latency of dense vector search vs library size")
+    vectors.add_argument("--chunks", type=int, nargs="+", default=[10000, 100000, 300000])
+
+    throughput = subparsers.add_parser("throughput", help="Model requests per second against the local mock server")
+    throughput.add_argument("--backend", choices=["huggingface", "tgi", "openai"], default="tgi")
+    throughput.add_argument("--prompts", type=int, default=200)
+    throughput.add_argument("--latency", type=float, default=0.2)
+    throughput.add_argument("--error-rate", type=float, default=0.0)
+    throughput.add_argument("--throttle-rate", type=float, default=0.0)
+    throughput.add_argument("--server-concurrency", type=int, default=0)
+
+    measure = subparsers.add_parser("_measure")
+    measure.add_argument("path")
+    measure.add_argument("large", choices=["0", "1"])
+
+    args = parser.parse_args()
+    if args.benchmark == "large-document":
+        bench_large_document(args.pages)
+    elif args.benchmark == "clean-text":
+        bench_clean_text(args.megabytes)
+    elif args.benchmark == "vector-search":
+        bench_vector_search(args.chunks)
+    elif args.benchmark == "throughput":
+        bench_throughput(args.backend, args.prompts, args.latency, args.error_rate, args.throttle_rate, args.server_concurrency)
+    elif args.benchmark == "_measure":
+        _measure_extraction(args.path, args.large == "1")
+
+if __name__ == "__main__":
+    main()
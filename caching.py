@@ -0,0 +1,393 @@
+import os
+import json
+import asyncio
+import time
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Mapping, Optional, Union, BinaryIO
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.getenv("STUDYMATE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "studymate"))
+
+def hash_content(data: Union[bytes, BinaryIO, str], block_size: int = 1024 * 1024) -> str:
+    """SHA-256 of raw bytes, a file-like object or a file path, read in blocks"""
+    digest = hashlib.sha256()
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        digest.update(data)
+        return digest.hexdigest()
+
+    if isinstance(data, str):
+        with open(data, 'rb') as f:
+            for block in iter(lambda: f.read(block_size), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    position = data.tell()
+    data.seek(0)
+    for block in iter(lambda: data.read(block_size), b''):
+        digest.update(block)
+    data.seek(position)
+    return digest.hexdigest()
+
+def _dump_streaming(entry: Dict[str, Any], f) -> None:
+    """
+    Write entry as JSON, serializing values that are plain iterables (generators,
+    disk-backed page stores) one item at a time instead of building a list
+    """
+    f.write('{')
+    for index, (key, value) in enumerate(entry.items()):
+        if index:
+            f.write(', ')
+        f.write(json.dumps(key) + ': ')
+        if value is None or isinstance(value, (str, int, float, bool, list, tuple, dict)):
+            json.dump(value, f, ensure_ascii=False)
+            continue
+        f.write('[')
+        for item_index, item in enumerate(value):
+            if item_index:
+                f.write(', ')
+            json.dump(item, f, ensure_ascii=False)
+        f.write(']')
+    f.write('}')
+
+class ExtractionCache:
+    """
+    Persistent on-disk cache of extracted PDF text keyed by a content hash.
+    Each entry is one JSON file; reads refresh the file's mtime so eviction
+    can drop the least recently used entries once max_bytes is exceeded.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.cache_dir = cache_dir or os.path.join(DEFAULT_CACHE_DIR, "extraction")
+        self.max_bytes = max_bytes or int(os.getenv("STUDYMATE_EXTRACTION_CACHE_MB", "256")) * 1024 * 1024
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached entry for key, or None on a miss"""
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            os.utime(path)  # Mark as recently used
+            return entry
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Discarding unreadable cache entry {key}: {str(e)}")
+            self.delete(key)
+            return None
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        """
+        Store entry under key and evict old entries if over the size limit.
+        Values may be iterables, which are streamed to disk as JSON lists.
+        """
+        # Write to a temp file first so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                _dump_streaming(entry, f)
+            os.replace(tmp_path, self._path(key))
+        except Exception as e:
+            logger.warning(f"Failed to write cache entry {key}: {str(e)}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        self._evict()
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def _evict(self) -> None:
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+                total += stat.st_size
+
+            if total <= self.max_bytes:
+                return
+
+            entries.sort()
+            for _, size, name in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                    total -= size
+                except OSError:
+                    continue
+
+class LRUCache:
+    """
+    Thread-safe in-memory map that drops the least recently used entry when full.
+    With max_bytes, entries are also weighed with sizeof (JSON size by default)
+    and evicted until the total fits; a value larger than max_bytes is not kept.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: Optional[int] = None,
+                 sizeof: Optional[Callable[[Any], int]] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._sizeof = sizeof or _json_size
+        self._sizes = {}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        size = self._sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            self._discard(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._entries[key] = value
+            self._sizes[key] = size
+            self.total_bytes += size
+            while len(self._entries) > self.max_entries or (
+                    self.max_bytes is not None and self.total_bytes > self.max_bytes):
+                self._discard(next(iter(self._entries)))
+
+    def _discard(self, key: Hashable) -> None:
+        if key in self._entries:
+            del self._entries[key]
+            self.total_bytes -= self._sizes.pop(key)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+def _json_size(value: Any) -> int:
+    return len(json.dumps(value, ensure_ascii=False, default=str).encode('utf-8'))
+
+class ResponseCache:
+    """
+    Cache of model responses with two tiers: an in-memory LRU in front of a
+    SQLite table that persists across restarts and is shared between processes.
+    Entries expire ttl seconds after they were stored; once the table grows past
+    max_bytes the least recently used rows are evicted. The memory tier holds
+    at most memory_entries responses and memory_bytes of text.
+    """
+
+    def __init__(self, path: Optional[str] = None, ttl: Optional[float] = None, max_bytes: Optional[int] = None,
+                 memory_entries: int = 1024, memory_bytes: Optional[int] = None):
+        self.path = path or os.path.join(DEFAULT_CACHE_DIR, "responses.sqlite3")
+        self.ttl = ttl if ttl is not None else float(os.getenv("STUDYMATE_RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+        self.max_bytes = max_bytes or int(os.getenv("STUDYMATE_RESPONSE_CACHE_MB", "64")) * 1024 * 1024
+        self.memory_bytes = memory_bytes or int(os.getenv("STUDYMATE_RESPONSE_MEMORY_MB", "16")) * 1024 * 1024
+        self.memory = self._memory_tier(memory_entries)
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Autocommit connection shared by all threads; self._lock serializes its use
+        self._db = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    def _memory_tier(self, max_entries: int) -> LRUCache:
+        # Entries are (text, created) pairs; weigh them by the text
+        return LRUCache(max_entries=max_entries, max_bytes=self.memory_bytes,
+                        sizeof=lambda entry: len(entry[0].encode('utf-8')))
+
+    @staticmethod
+    def make_key(model_name: str, prompt: str, parameters: Mapping[str, Any], endpoint: str = "") -> str:
+        """
+        Key for a (model, prompt hash, generation parameters, endpoint) combination.
+        endpoint names the server that answers (backend and URL), so completions
+        from a mock or local server are never served in place of the real one's.
+        """
+        prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        return hashlib.sha256(
+            json.dumps([model_name, prompt_hash, parameters, endpoint], sort_keys=True).encode('utf-8')
+        ).hexdigest()
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl > 0 and now - created > self.ttl
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for key, or None on a miss or expired entry"""
+        now = time.time()
+        entry = self.memory.get(key)
+        if entry is not None and not self._expired(entry[1], now):
+            with self._lock:
+                self.memory_hits += 1
+            return entry[0]
+
+        with self._lock:
+            try:
+                row = self._db.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and self._expired(row[1], now):
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    row = None
+                if row is not None:
+                    self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            except sqlite3.Error as e:
+                logger.warning(f"Response cache lookup failed: {str(e)}")
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        self.memory.put(key, (row[0], row[1]))
+        return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        """Store a response under key in both tiers and evict if over the size limit"""
+        now = time.time()
+        self.memory.put(key, (value, now))
+        size = len(value.encode('utf-8')) + len(key)
+        with self._lock:
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                    (key, value, size, now, now)
+                )
+                self._evict(now)
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to write response cache entry: {str(e)}")
+
+    def _evict(self, now: float) -> None:
+        """Drop expired rows, then least recently used rows until the table fits in max_bytes"""
+        if self.ttl > 0:
+            self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        stale = []
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY accessed"):
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", stale)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and the size of the persistent tier"""
+        with self._lock:
+            try:
+                entries, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            except sqlite3.Error:
+                entries = total = 0
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "hits": hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "entries": entries,
+                "bytes": total,
+            }
+
+    def clear(self) -> None:
+        self.memory = self._memory_tier(self.memory.max_entries)
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one: the first caller
+    runs the function, and callers arriving while it is in flight wait for it
+    and share its result or exception. Sync and async callers, from any thread,
+    share the same in-flight calls.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._in_flight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key: Hashable) -> tuple:
+        """The in-flight call for key, and whether this caller has to run it"""
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = Future()
+            self._in_flight[key] = future
+            self.calls += 1
+            return future, True
+
+    def _finish(self, key: Hashable, future: Future, result: Any = None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            del self._in_flight[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key: Hashable, function: Callable[[], Any]) -> Any:
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            result = function()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    async def do_async(self, key: Hashable, function: Callable[[], Awaitable[Any]]) -> Any:
+        future, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+        try:
+            result = await function()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._in_flight)}
@@ -0,0 +1,127 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+class Job:
+    """A function call handed to a JobRunner; status goes from queued to running to done, failed or cancelled"""
+
+    def __init__(self, job_id: str, action: str):
+        self.id = job_id
+        self.action = action
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.future = None
+
+    @property
+    def active(self) -> bool:
+        return self.status in (QUEUED, RUNNING)
+
+    def elapsed(self) -> float:
+        """Seconds spent running so far, or waiting while still queued"""
+        return (self.finished or time.time()) - (self.started or self.submitted)
+
+class JobRunner:
+    """
+    Runs model calls on a thread pool so a Streamlit script run can hand them
+    off and return straight away. Jobs are looked up by id on later reruns, from
+    any page; finished jobs nobody collects are dropped retention seconds later.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, retention: Optional[float] = None):
+        self.max_workers = max_workers or int(os.getenv("STUDYMATE_JOB_WORKERS", "4"))
+        self.retention = retention if retention is not None else float(os.getenv("STUDYMATE_JOB_RETENTION", "3600"))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="studymate-job")
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, action: str, function: Callable[..., Any], *args, **kwargs) -> str:
+        """Queue function(*args, **kwargs) and return the new job's id"""
+        job = Job(uuid.uuid4().hex, action)
+        with self._lock:
+            self._prune(time.time())
+            self._jobs[job.id] = job
+        job.future = self._executor.submit(self._run, job, function, args, kwargs)
+        return job.id
+
+    def _run(self, job: Job, function: Callable[..., Any], args, kwargs) -> None:
+        with self._lock:
+            if job.status == CANCELLED:
+                return
+            job.status = RUNNING
+            job.started = time.time()
+
+        failed = False
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            logger.warning(f"Job {job.id} ({job.action}) failed: {str(e)}")
+            failed = True
+            result = str(e) or e.__class__.__name__
+
+        with self._lock:
+            if job.status == CANCELLED:
+                return  # Nobody is waiting for this result any more
+            job.finished = time.time()
+            if failed:
+                job.status = FAILED
+                job.error = result
+            else:
+                job.status = DONE
+                job.result = result
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def wait(self, job_id: str, timeout: float) -> Optional[Job]:
+        """Block until the job finishes or timeout seconds pass, whichever is first"""
+        job = self.get(job_id)
+        if job is not None and job.active and job.future is not None:
+            wait([job.future], timeout=timeout)
+        return job
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancel a job that has not finished. A queued job never starts; a running
+        one is left to finish in its thread, but its result is thrown away.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or not job.active:
+                return False
+            job.status = CANCELLED
+            job.finished = time.time()
+        if job.future is not None:
+            job.future.cancel()
+        return True
+
+    def discard(self, job_id: str) -> None:
+        """Forget a job once its result has been collected"""
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def _prune(self, now: float) -> None:
+        stale = [job_id for job_id, job in self._jobs.items()
+                 if not job.active and now - job.finished > self.retention]
+        for job_id in stale:
+            del self._jobs[job_id]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._jobs)
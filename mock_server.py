@@ -0,0 +1,189 @@
+"""
+Local stand-in for an inference server, for offline development and load tests.
+Speaks the Hugging Face Inference API (POST /models/<model>), TGI (POST /generate
+and /generate_stream) and OpenAI completions (POST /v1/completions) formats, with
+configurable latency and injected failures.
+
+Run with:
+    python mock_server.py --port 8080 --latency 0.5 --error-rate 0.05 --throttle-rate 0.05
+    STUDYMATE_BACKEND=tgi STUDYMATE_BACKEND_URL=http://127.0.0.1:8080 streamlit run app.py
+
+Completions are built from the prompt, so the same prompt always gets the same
+answer. GET /stats reports request counts.
+"""
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+class MockSettings:
+    def __init__(self, latency: float = 0.2, jitter: float = 0.0, token_delay: float = 0.02, error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, retry_after: float = 1.0, max_concurrency: int = 0, seed: Optional[int] = None):
+        self.latency = latency  # Seconds before each response starts
+        self.jitter = jitter  # Up to this many seconds added to or taken from latency
+        self.token_delay = token_delay  # Seconds between streamed tokens
+        self.error_rate = error_rate  # Share of requests answered with a 500
+        self.throttle_rate = throttle_rate  # Share of requests answered with a 429
+        self.retry_after = retry_after
+        self.max_concurrency = max_concurrency  # Requests in flight beyond this get a 429; 0 for no limit
+        self.random = random.Random(seed)
+        self.stats = {"requests": 0, "completed": 0, "errors": 0, "throttled": 0, "in_flight": 0, "peak_in_flight": 0}
+        self.lock = threading.Lock()
+
+def mock_completion(prompt: str, max_tokens: int) -> List[str]:
+    """Deterministic completion tokens for prompt: a digest of it followed by its last words"""
+    digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:8]
+    words = prompt.replace("<|assistant|>", " ").split()
+    tokens = ["Mock", f"completion {digest}:"] + words[-30:]
+    return [f" {token}" for token in tokens[:max(max_tokens, 1)]]
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # Headers and body go out as separate writes on kept-alive connections
+    settings: MockSettings = None
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def _send_json(self, status: int, body: Any, headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_events(self, events: List[str]) -> None:
+        # No Content-Length: the stream ends when the connection closes
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for event in events:
+            self.wfile.write(f"data: {event}\n\n".encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(self.settings.token_delay)
+
+    def do_GET(self) -> None:
+        if self.path != "/stats":
+            self._send_json(404, {"error": "Not found"})
+            return
+        with self.settings.lock:
+            self._send_json(200, dict(self.settings.stats))
+
+    def do_POST(self) -> None:
+        settings = self.settings
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with settings.lock:
+            stats = settings.stats
+            stats["requests"] += 1
+            stats["in_flight"] += 1
+            stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+            over_limit = settings.max_concurrency and stats["in_flight"] > settings.max_concurrency
+            roll = settings.random.random()
+            delay = max(0.0, settings.latency + settings.random.uniform(-settings.jitter, settings.jitter))
+        try:
+            if over_limit or roll < settings.throttle_rate:
+                self._count("throttled")
+                self._send_json(429, {"error": "Rate limit reached"}, {"Retry-After": f"{settings.retry_after:g}"})
+                return
+            time.sleep(delay)
+            if roll < settings.throttle_rate + settings.error_rate:
+                self._count("errors")
+                self._send_json(500, {"error": "Injected failure"})
+                return
+            self._respond(body)
+            self._count("completed")
+        finally:
+            with settings.lock:
+                settings.stats["in_flight"] -= 1
+
+    def _count(self, counter: str) -> None:
+        with self.settings.lock:
+            self.settings.stats[counter] += 1
+
+    def _respond(self, body: Dict[str, Any]) -> None:
+        if self.path == "/v1/completions":
+            self._respond_openai(body)
+        elif self.path in ("/generate", "/generate_stream") or self.path.startswith("/models/"):
+            self._respond_text_generation(body, stream=self.path == "/generate_stream" or body.get("stream", False))
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def _respond_text_generation(self, body: Dict[str, Any], stream: bool) -> None:
+        """Hugging Face Inference API and TGI: {"inputs", "parameters"}"""
+        max_tokens = (body.get("parameters") or {}).get("max_new_tokens", 100)
+        inputs = body.get("inputs", "")
+        if not stream:
+            if isinstance(inputs, list):
+                self._send_json(200, [[{"generated_text": "".join(mock_completion(prompt, max_tokens))}] for prompt in inputs])
+            elif self.path == "/generate":
+                self._send_json(200, {"generated_text": "".join(mock_completion(inputs, max_tokens))})
+            else:
+                self._send_json(200, [{"generated_text": "".join(mock_completion(inputs, max_tokens))}])
+            return
+
+        tokens = mock_completion(inputs, max_tokens)
+        events = [json.dumps({"token": {"id": index, "text": token, "logprob": 0.0, "special": False},
+                              "generated_text": "".join(tokens) if index == len(tokens) - 1 else None})
+                  for index, token in enumerate(tokens)]
+        self._send_events(events)
+
+    def _respond_openai(self, body: Dict[str, Any]) -> None:
+        """OpenAI completions: {"model", "prompt", "max_tokens", "stream"}"""
+        max_tokens = body.get("max_tokens", 16)
+        prompts = body.get("prompt", "")
+        prompts = prompts if isinstance(prompts, list) else [prompts]
+        model = body.get("model", "mock")
+        if not body.get("stream"):
+            choices = [{"text": "".join(mock_completion(prompt, max_tokens)), "index": index, "finish_reason": "length"}
+                       for index, prompt in enumerate(prompts)]
+            self._send_json(200, {"object": "text_completion", "model": model, "choices": choices})
+            return
+
+        events = [json.dumps({"object": "text_completion", "model": model,
+                              "choices": [{"text": token, "index": 0, "finish_reason": None}]})
+                  for token in mock_completion(prompts[0], max_tokens)]
+        self._send_events(events + ["[DONE]"])
+
+def serve(settings: MockSettings, host: str = "127.0.0.1", port: int = 8080) -> ThreadingHTTPServer:
+    """Start the mock server on a background thread; port 0 picks a free port"""
+    handler = type("ConfiguredMockHandler", (MockHandler,), {"settings": settings})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-inference-server", daemon=True).start()
+    return server
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Mock inference server (Hugging Face, TGI and OpenAI formats)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before each response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- seconds on the latency")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="Seconds between streamed tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests that fail with a 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests refused with a 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with a 429")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="Requests in flight before answering 429 (0: no limit)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    settings = MockSettings(args.latency, args.jitter, args.token_delay, args.error_rate, args.throttle_rate,
+                            args.retry_after, args.max_concurrency, args.seed)
+    server = serve(settings, args.host, args.port)
+    print(f"Mock inference server on http://{args.host}:{server.server_port} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
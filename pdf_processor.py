@@ -1,17 +1,285 @@
 import PyPDF2
 import io
+import os
 import re
+import hashlib
+import itertools
 import logging
-from typing import Optional, Union, BinaryIO
+import tempfile
+import multiprocessing
+from array import array
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union, BinaryIO
+
+from PyPDF2 import PageObject
+from PyPDF2.generic import IndirectObject, NameObject
+
+from caching import ExtractionCache, hash_content
+from tokenization import TokenCounter, load_token_counter, pack_chunks
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Text normalization used by clean_text. Every whitespace character maps to a
+# space (str.isspace() has no matches above U+3000), then a single regex pass:
+#   - joins words hyphenated across a line break ("intro- duction"); like the
+#     previous left-to-right re.sub, a hyphen right after a joined word is kept
+#   - drops spaces before punctuation
+#   - collapses runs of spaces
+# Every branch starts with a literal "-" or " " so the regex engine can skip
+# ordinary text quickly.
+_WHITESPACE_TO_SPACE = {codepoint: ' ' for codepoint in range(0x3001) if chr(codepoint).isspace()}
+_NORMALIZE_PATTERN = re.compile(
+    r'-(?<=\w-) +(\w)(?:(-)( ) *(\w))?'
+    r'| (?: *(?=[.,;:!?])|( ) *)'
+)
+
+INHERITABLE_PAGE_ATTRIBUTES = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+RESOLVED_OBJECT_WINDOW = 64  # Pages between clearing PyPDF2's object cache in large-document mode
+
+# Fresh worker processes rather than forks of a process holding Streamlit's threads and the upload
+_start_methods = multiprocessing.get_all_start_methods()
+WORKER_CONTEXT = multiprocessing.get_context("forkserver" if "forkserver" in _start_methods else "spawn")
+
+def _open_reader(source: Union[bytes, str]) -> PyPDF2.PdfReader:
+    """Open a reader on raw bytes, or on a file handle so a path is never read into memory"""
+    if isinstance(source, bytes):
+        return PyPDF2.PdfReader(io.BytesIO(source))
+    return PyPDF2.PdfReader(open(source, 'rb'))
+
+def _page_count(pdf_reader: PyPDF2.PdfReader, lazy: bool = False) -> int:
+    """Page count; lazy reads the page tree's /Count instead of flattening it"""
+    if lazy:
+        try:
+            return int(pdf_reader.trailer["/Root"].get_object()["/Pages"].get_object()["/Count"])
+        except Exception:
+            pass  # Fall back to flattening the page tree
+    return len(pdf_reader.pages)
+
+def _iter_page_objects(pdf_reader: PyPDF2.PdfReader, start: int = 0) -> Iterator[PageObject]:
+    """
+    Walk the page tree from page index start without flattening it, so only
+    the current branch is held in memory. Subtrees before start are skipped
+    using their /Count.
+    """
+    skip = [start]
+    
+    def walk(node: Any, inherit: Dict[str, Any]) -> Iterator[PageObject]:
+        node_obj = node.get_object()
+        node_type = node_obj.get("/Type", "/Pages")
+        
+        if node_type == "/Pages":
+            inherit = dict(inherit)
+            inherit.update((attr, node_obj[attr]) for attr in INHERITABLE_PAGE_ATTRIBUTES if attr in node_obj)
+            for kid in node_obj["/Kids"]:
+                kid_obj = kid.get_object()
+                if kid_obj.get("/Type", "/Pages") == "/Pages" and "/Count" in kid_obj and skip[0] >= int(kid_obj["/Count"]):
+                    skip[0] -= int(kid_obj["/Count"])
+                    continue
+                yield from walk(kid, inherit)
+        elif node_type == "/Page":
+            if skip[0] > 0:
+                skip[0] -= 1
+                return
+            page = PageObject(pdf_reader, node if isinstance(node, IndirectObject) else None)
+            page.update(node_obj)
+            for attr, value in inherit.items():
+                # A page's own value takes precedence over its parent's
+                if attr not in page:
+                    page[NameObject(attr)] = value
+            yield page
+    
+    return walk(pdf_reader.trailer["/Root"].get_object()["/Pages"], {})
+
+def _iter_page_range(pdf_reader: PyPDF2.PdfReader, start: int, stop: int, lazy: bool = False) -> Iterator[Tuple[int, str]]:
+    """Yield (page_index, text) for pages [start, stop) with text, skipping pages that fail"""
+    pages = _iter_page_objects(pdf_reader, start) if lazy else None
+    for page_num in range(start, stop):
+        try:
+            page = next(pages) if lazy else pdf_reader.pages[page_num]
+            text = page.extract_text()
+            if text:
+                yield page_num, text.strip()
+        except StopIteration:
+            break
+        except Exception as e:
+            logger.error(f"Error processing page {page_num + 1}: {str(e)}")
+            continue
+        finally:
+            # Drop parsed content streams and fonts so memory stays flat on long documents
+            if lazy and (page_num - start) % RESOLVED_OBJECT_WINDOW == RESOLVED_OBJECT_WINDOW - 1:
+                pdf_reader.resolved_objects.clear()
+
+def _extract_page_range_worker(source: Union[bytes, str], start: int, stop: int, lazy: bool = False) -> List[Tuple[int, str]]:
+    """Process pool entry point: each worker opens its own reader on the PDF"""
+    pdf_reader = _open_reader(source)
+    try:
+        return list(_iter_page_range(pdf_reader, start, stop, lazy))
+    finally:
+        pdf_reader.stream.close()
+
+class PageStore:
+    """
+    Append-only list of (page_number, text) pairs kept in a temporary file,
+    so extracted text from very long documents does not have to stay in RAM.
+    """
+    
+    def __init__(self, directory: Optional[str] = None):
+        self._file = tempfile.TemporaryFile(dir=directory)
+        self._page_numbers = array('l')
+        self._offsets = array('q', [0])
+    
+    def append(self, page: Tuple[int, str]) -> None:
+        page_number, text = page
+        data = text.encode('utf-8')
+        self._file.seek(self._offsets[-1])
+        self._file.write(data)
+        self._page_numbers.append(page_number)
+        self._offsets.append(self._offsets[-1] + len(data))
+    
+    def __len__(self) -> int:
+        return len(self._page_numbers)
+    
+    def __getitem__(self, index: int) -> Tuple[int, str]:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("page index out of range")
+        self._file.seek(self._offsets[index])
+        data = self._file.read(self._offsets[index + 1] - self._offsets[index])
+        return self._page_numbers[index], data.decode('utf-8')
+    
+    def __iter__(self) -> Iterator[Tuple[int, str]]:
+        for index in range(len(self)):
+            yield self[index]
+    
+    def text(self, separator: str = "\n\n") -> str:
+        """Join all pages into one string (this does load the whole text)"""
+        return separator.join(text for _, text in self)
+    
+    def close(self) -> None:
+        self._file.close()
+    
+    def __enter__(self) -> "PageStore":
+        return self
+    
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+def join_pages(pages: Iterable[Tuple[int, str]], separator: str = "\n\n") -> Tuple[str, List[Tuple[int, int]]]:
+    """Join page texts like extract_text and return (text, [(start_char, page_number), ...])"""
+    parts = []
+    page_offsets = []
+    position = 0
+    for page_number, text in pages:
+        if parts:
+            position += len(separator)
+        page_offsets.append((position, page_number))
+        parts.append(text)
+        position += len(text)
+    return separator.join(parts), page_offsets
+
+class ChunkIndex:
+    """
+    Overlapping word-window chunks of a text, stored as (start_char, end_char, page)
+    offsets in compact arrays. Chunk strings are only built when accessed, so the
+    document is not duplicated in memory once per chunk.
+    """
+    
+    def __init__(self, text: str, starts: array, ends: array, pages: array):
+        self.text = text
+        self.starts = starts
+        self.ends = ends
+        self.pages = pages
+    
+    @classmethod
+    def build(cls, text: str, chunk_size: int = 500, overlap: int = 100,
+              page_offsets: Optional[List[Tuple[int, int]]] = None) -> "ChunkIndex":
+        """
+        Index chunks of chunk_size words, each starting chunk_size - overlap words
+        after the previous one. page_offsets is the second value returned by
+        join_pages; without it every chunk is attributed to page 0.
+        """
+        step = chunk_size - overlap
+        if step <= 0:
+            raise ValueError("overlap must be smaller than chunk_size")
+        
+        word_starts = array('q')
+        word_ends = array('q')
+        for match in re.finditer(r'\S+', text):
+            word_starts.append(match.start())
+            word_ends.append(match.end())
+        
+        starts, ends = array('q'), array('q')
+        for first_word in range(0, len(word_starts), step):
+            last_word = min(first_word + chunk_size, len(word_starts)) - 1
+            starts.append(word_starts[first_word])
+            ends.append(word_ends[last_word])
+        
+        index = cls(text, starts, ends, array('l', [0]) * len(starts))
+        if page_offsets:
+            index.assign_pages(page_offsets)
+        return index
+    
+    def assign_pages(self, page_offsets: List[Tuple[int, int]]) -> None:
+        """Attribute each chunk to the page it starts on, from join_pages offsets"""
+        page_starts = [offset for offset, _ in page_offsets]
+        pages = array('l')
+        for start in self.starts:
+            page_index = bisect_right(page_starts, start) - 1
+            pages.append(page_offsets[page_index][1] if page_index >= 0 else 0)
+        self.pages = pages
+    
+    def __len__(self) -> int:
+        return len(self.starts)
+    
+    def __getitem__(self, index: int) -> str:
+        """Chunk text with whitespace collapsed, as chunk_text returns it"""
+        start, end, _ = self.span(index)
+        return ' '.join(self.text[start:end].split())
+    
+    def __iter__(self) -> Iterator[str]:
+        for index in range(len(self)):
+            yield self[index]
+    
+    def span(self, index: int) -> Tuple[int, int, int]:
+        """(start_char, end_char, page) of a chunk"""
+        return self.starts[index], self.ends[index], self.pages[index]
+    
+    def page(self, index: int) -> int:
+        """Page number the chunk starts on"""
+        return self.pages[index]
+
 class PDFProcessor:
-    def __init__(self):
-        self.max_file_size = 10 * 1024 * 1024  # 10MB limit
-        self.max_pages = 50  # Limit number of pages to process
+    def __init__(self, max_workers: Optional[int] = None, cache: Optional[ExtractionCache] = None, use_cache: bool = True,
+                 max_pages: Optional[int] = None, large_document: Optional[bool] = None):
+        self.max_file_size = 200 * 1024 * 1024  # 200MB limit, matching the upload page
+        self.max_pages = max_pages  # Optional limit on number of pages to process (None processes all)
+        self.max_workers = max_workers or os.cpu_count() or 1  # Process pool size for parallel extraction
+        self.parallel_page_threshold = 16  # Minimum page count before parallel extraction pays off
+        
+        # Large-document mode spools uploads to disk, walks the page tree lazily and
+        # spills page text to disk, so peak memory stays flat as page count grows.
+        # None switches it on per document using the thresholds below.
+        self.large_document = large_document
+        self.large_file_threshold = 20 * 1024 * 1024
+        self.large_page_threshold = 300
+        self.large_range_pages = 64  # Pages per process pool task in large-document mode
+        self.spool_block_size = 1024 * 1024
+        
+        # Content-addressed cache so repeat uploads of the same PDF skip PyPDF2
+        self.cache = cache
+        if self.cache is None and use_cache:
+            try:
+                self.cache = ExtractionCache()
+            except Exception as e:
+                logger.warning(f"Extraction cache disabled: {str(e)}")
+    
+    def _page_limit(self, total_pages: int) -> int:
+        return total_pages if self.max_pages is None else min(total_pages, self.max_pages)
     
     def _validate_pdf(self, file: BinaryIO) -> bool:
         """Validate PDF file"""
@@ -35,38 +303,157 @@ class PDFProcessor:
             logger.error(f"PDF validation failed: {str(e)}")
             raise
     
-    def extract_text(self, uploaded_file: Union[BinaryIO, str]) -> str:
-        """Extract text from uploaded PDF file with error handling"""
+    def _load_source(self, uploaded_file: Union[BinaryIO, str]) -> Tuple[Union[bytes, str], Optional[str], bool]:
+        """
+        Validate the PDF and return its source (bytes or path), its cache key and
+        whether the source is a spooled temporary file the caller must remove
+        """
+        if hasattr(uploaded_file, 'read'):  # Handle file-like object
+            if not self._validate_pdf(uploaded_file):
+                raise ValueError("Invalid PDF file")
+            
+            uploaded_file.seek(0, 2)
+            file_size = uploaded_file.tell()
+            uploaded_file.seek(0)
+            if self.large_document or (self.large_document is None and file_size > self.large_file_threshold):
+                source, digest = self._spool_to_disk(uploaded_file)
+                return source, digest if self.cache else None, True
+            
+            # Workers re-open the PDF themselves, so keep the raw bytes around
+            source = uploaded_file.read()
+            uploaded_file.seek(0)
+        else:  # Handle file path
+            with open(uploaded_file, 'rb') as f:
+                if not self._validate_pdf(f):
+                    raise ValueError("Invalid PDF file")
+            source = uploaded_file
+        
+        cache_key = hash_content(source) if self.cache else None
+        return source, cache_key, False
+    
+    def _spool_bytes(self, source: bytes) -> str:
+        """Write PDF bytes to a temporary file so pool workers can open it by path"""
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as spool:
+            spool.write(source)
+        return spool.name
+    
+    def _spool_to_disk(self, uploaded_file: BinaryIO) -> Tuple[str, str]:
+        """Copy an upload to a temporary file in blocks, hashing it on the way"""
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as spool:
+            for block in iter(lambda: uploaded_file.read(self.spool_block_size), b''):
+                digest.update(block)
+                spool.write(block)
+        uploaded_file.seek(0)
+        return spool.name, digest.hexdigest()
+    
+    def _cached_entry(self, cache_key: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Cached extraction for cache_key, if it was made with the current page limit"""
+        if not cache_key:
+            return None
+        entry = self.cache.get(cache_key)
+        if entry is None or entry.get('processed_pages') != self._page_limit(entry.get('total_pages', 0)):
+            return None
+        return entry
+    
+    def _store_entry(self, cache_key: Optional[str], metadata: dict, total_pages: int, num_pages: int,
+                     pages: Iterable[Tuple[int, str]]) -> None:
+        """Save extracted and cleaned page text plus metadata for later uploads"""
+        if not cache_key:
+            return
+        self.cache.put(cache_key, {
+            'total_pages': total_pages,
+            'processed_pages': num_pages,
+            'metadata': metadata,
+            'pages': pages,
+            'cleaned_pages': ((page_number, self.clean_text(text)) for page_number, text in pages)
+        })
+    
+    def count_pages(self, uploaded_file: Union[BinaryIO, str]) -> int:
+        """Number of pages iter_pages will process, after the max_pages limit"""
         try:
-            if hasattr(uploaded_file, 'read'):  # Handle file-like object
+            if self.cache:
+                entry = self._cached_entry(hash_content(uploaded_file))
+                if entry is not None:
+                    return entry['processed_pages']
+            
+            if hasattr(uploaded_file, 'read'):
                 if not self._validate_pdf(uploaded_file):
                     raise ValueError("Invalid PDF file")
-                
-                # Read the uploaded file
-                pdf_reader = PyPDF2.PdfReader(uploaded_file)
-            else:  # Handle file path
-                with open(uploaded_file, 'rb') as f:
-                    if not self._validate_pdf(f):
-                        raise ValueError("Invalid PDF file")
-                    pdf_reader = PyPDF2.PdfReader(f)
+                # Read the page tree's /Count straight from the upload without copying it
+                count = _page_count(PyPDF2.PdfReader(uploaded_file), lazy=True)
+                uploaded_file.seek(0)
+            else:
+                pdf_reader = _open_reader(uploaded_file)
+                try:
+                    count = _page_count(pdf_reader, lazy=True)
+                finally:
+                    pdf_reader.stream.close()
+            return self._page_limit(count)
+        except PyPDF2.errors.PdfReadError as e:
+            logger.error(f"PDF read error: {str(e)}")
+            raise ValueError("Failed to read PDF. The file might be corrupted or password protected.")
+    
+    def iter_pages(self, uploaded_file: Union[BinaryIO, str], parallel: Optional[bool] = None) -> Iterator[Tuple[int, str]]:
+        """
+        Yield (page_number, text) for each page with text as soon as it is extracted.
+        Page numbers are 1-based and always ascending. With parallel=None, page
+        ranges are spread over a process pool once the document has at least
+        parallel_page_threshold pages. Previously seen PDFs are served from the
+        extraction cache without parsing.
+        """
+        spooled_path = None
+        try:
+            source, cache_key, spooled = self._load_source(uploaded_file)
+            if spooled:
+                spooled_path = source
             
-            # Limit number of pages to process
-            num_pages = min(len(pdf_reader.pages), self.max_pages)
-            if num_pages < len(pdf_reader.pages):
-                logger.warning(f"Processing only first {num_pages} pages of {len(pdf_reader.pages)}")
+            entry = self._cached_entry(cache_key)
+            if entry is not None:
+                for page_number, text in entry['pages']:
+                    yield page_number, text
+                return
             
-            text_parts = []
-            for page_num in range(num_pages):
+            pdf_reader = _open_reader(source)
+            try:
+                large = spooled or bool(self.large_document)
+                if self.large_document is None and not large:
+                    large = _page_count(pdf_reader, lazy=True) > self.large_page_threshold
+                
+                # Limit number of pages to process
+                total_pages = _page_count(pdf_reader, lazy=large)
+                num_pages = self._page_limit(total_pages)
+                if num_pages < total_pages:
+                    logger.warning(f"Processing only first {num_pages} pages of {total_pages}")
+                
+                if parallel is None:
+                    parallel = self.max_workers > 1 and num_pages >= self.parallel_page_threshold
+                
+                if parallel:
+                    page_texts = self._iter_parallel(source, num_pages, large)
+                else:
+                    page_texts = _iter_page_range(pdf_reader, 0, num_pages, lazy=large)
+                
+                # Pages are only kept for the cache; long documents spill them to disk
+                pages = None
+                if cache_key:
+                    pages = PageStore() if large else []
+                
                 try:
-                    page = pdf_reader.pages[page_num]
-                    text = page.extract_text()
-                    if text:
-                        text_parts.append(text.strip())
-                except Exception as e:
-                    logger.error(f"Error processing page {page_num + 1}: {str(e)}")
-                    continue
-            
-            return "\n\n".join(text_parts) if text_parts else ""
+                    for page_num, text in page_texts:
+                        if pages is not None:
+                            pages.append((page_num + 1, text))
+                        yield page_num + 1, text
+                    
+                    # Only reached when the caller consumed every page
+                    if pages is not None:
+                        metadata = self._read_metadata(pdf_reader, total_pages)
+                        self._store_entry(cache_key, metadata, total_pages, num_pages, pages)
+                finally:
+                    if isinstance(pages, PageStore):
+                        pages.close()
+            finally:
+                pdf_reader.stream.close()
             
         except PyPDF2.errors.PdfReadError as e:
             logger.error(f"PDF read error: {str(e)}")
@@ -74,6 +461,77 @@ class PDFProcessor:
         except Exception as e:
             logger.error(f"Error extracting text from PDF: {str(e)}")
             raise ValueError(f"Failed to process PDF: {str(e)}")
+        finally:
+            if spooled_path:
+                os.remove(spooled_path)
+    
+    def extract_text(self, uploaded_file: Union[BinaryIO, str], parallel: Optional[bool] = None) -> str:
+        """Extract text from uploaded PDF file with error handling"""
+        text_parts = [text for _, text in self.iter_pages(uploaded_file, parallel=parallel)]
+        return "\n\n".join(text_parts) if text_parts else ""
+    
+    def extract_to_store(self, uploaded_file: Union[BinaryIO, str], parallel: Optional[bool] = None) -> PageStore:
+        """Extract every page into a disk-backed PageStore; the caller closes it"""
+        store = PageStore()
+        try:
+            for page in self.iter_pages(uploaded_file, parallel=parallel):
+                store.append(page)
+        except Exception:
+            store.close()
+            raise
+        return store
+    
+    def extract_clean_pages(self, uploaded_file: Union[BinaryIO, str]) -> List[Tuple[int, str]]:
+        """Return (page_number, cleaned_text) pairs, from the cache when available"""
+        if self.cache:
+            entry = self._cached_entry(hash_content(uploaded_file))
+            if entry is not None:
+                return [tuple(page) for page in entry['cleaned_pages']]
+        return [(page_number, self.clean_text(text)) for page_number, text in self.iter_pages(uploaded_file)]
+    
+    def _iter_parallel(self, source: Union[bytes, str], num_pages: int, large: bool = False) -> Iterator[Tuple[int, str]]:
+        """Extract pages across a process pool, yielding each range in page order"""
+        workers = max(1, min(self.max_workers, num_pages))
+        # A few ranges per worker keeps the pool busy when some pages are slower than others
+        range_size = max(1, -(-num_pages // (workers * 4)))
+        if large:
+            range_size = min(range_size, self.large_range_pages)
+        ranges = [(start, min(start + range_size, num_pages)) for start in range(0, num_pages, range_size)]
+        
+        next_page = 0
+        # Workers get a path, not a copy of the PDF with every range they are sent
+        spooled_path = self._spool_bytes(source) if isinstance(source, bytes) else None
+        worker_source = spooled_path or source
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=WORKER_CONTEXT)
+        try:
+            # Keep a bounded number of ranges in flight so finished text doesn't pile up
+            pending = deque()
+            remaining = iter(ranges)
+            for start, stop in itertools.islice(remaining, workers * 2):
+                pending.append((stop, executor.submit(_extract_page_range_worker, worker_source, start, stop, large)))
+            
+            while pending:
+                stop, future = pending.popleft()  # Collect in submission order to keep pages ordered
+                page_texts = future.result()
+                for start, next_stop in itertools.islice(remaining, 1):
+                    pending.append((next_stop, executor.submit(_extract_page_range_worker, worker_source, start, next_stop, large)))
+                yield from page_texts
+                next_page = stop
+            return
+        except Exception as e:
+            logger.warning(f"Parallel extraction failed, falling back to serial: {str(e)}")
+        finally:
+            # Don't leave queued ranges running if the caller stops iterating early
+            executor.shutdown(wait=spooled_path is not None, cancel_futures=True)
+            if spooled_path:
+                os.remove(spooled_path)
+        
+        # Resume serially from the first range that did not complete
+        pdf_reader = _open_reader(source)
+        try:
+            yield from _iter_page_range(pdf_reader, next_page, num_pages, lazy=large)
+        finally:
+            pdf_reader.stream.close()
     
     def clean_text(self, text: str) -> str:
         """Clean and normalize extracted text"""
@@ -81,15 +539,9 @@ class PDFProcessor:
             return ""
             
         try:
-            # Remove excessive whitespace and normalize newlines
-            text = ' '.join(text.split())
-            
-            # Fix common OCR/PDF extraction artifacts
-            text = re.sub(r'\s+', ' ', text)  # Replace multiple spaces with single space
-            text = re.sub(r'\s+([.,;:!?])', r'\1', text)  # Fix spaces before punctuation
-            text = re.sub(r'([\w])-\s+([\w])', r'\1\2', text)  # Fix hyphenated words
-            
-            return text.strip()
+            # Normalize whitespace, fix spaces before punctuation and hyphenated
+            # words in a single pass
+            return _NORMALIZE_PATTERN.sub(r'\1\2\3\4\5', text.translate(_WHITESPACE_TO_SPACE)).strip(' ')
             
         except Exception as e:
             logger.error(f"Error cleaning text: {str(e)}")
@@ -99,35 +551,50 @@ class PDFProcessor:
         """
         Split text into overlapping chunks for better retrieval
         """
-        words = text.split()
-        chunks = []
-        
-        for i in range(0, len(words), chunk_size - overlap):
-            chunk = ' '.join(words[i:i + chunk_size])
-            if len(chunk.strip()) > 0:
-                chunks.append(chunk)
-        
-        return chunks
+        return list(self.build_chunk_index(text, chunk_size, overlap))
+    
+    def build_chunk_index(self, text: str, chunk_size: int = 500, overlap: int = 100,
+                          page_offsets: Optional[List[Tuple[int, int]]] = None) -> ChunkIndex:
+        """
+        Offset-based chunk index over text with page provenance; see ChunkIndex
+        """
+        return ChunkIndex.build(text, chunk_size, overlap, page_offsets)
+    
+    def chunk_by_tokens(self, text: str, max_tokens: int, counter: Optional[TokenCounter] = None) -> List[str]:
+        """
+        Split text into chunks of at most max_tokens model tokens, packed on
+        sentence and paragraph boundaries
+        """
+        return pack_chunks(text, max_tokens, counter or load_token_counter())
     
     def extract_metadata(self, uploaded_file) -> dict:
         """
         Extract metadata from PDF
         """
         try:
-            pdf_reader = PyPDF2.PdfReader(uploaded_file)
-            metadata = {}
-            
-            if pdf_reader.metadata:
-                metadata['title'] = pdf_reader.metadata.get('/Title', 'Unknown')
-                metadata['author'] = pdf_reader.metadata.get('/Author', 'Unknown')
-                metadata['subject'] = pdf_reader.metadata.get('/Subject', 'Unknown')
-                metadata['creator'] = pdf_reader.metadata.get('/Creator', 'Unknown')
-                metadata['producer'] = pdf_reader.metadata.get('/Producer', 'Unknown')
-                metadata['creation_date'] = pdf_reader.metadata.get('/CreationDate', 'Unknown')
+            if self.cache:
+                entry = self.cache.get(hash_content(uploaded_file))
+                if entry is not None and 'metadata' in entry:
+                    return entry['metadata']
             
-            metadata['num_pages'] = len(pdf_reader.pages)
-            
-            return metadata
+            pdf_reader = PyPDF2.PdfReader(uploaded_file)
+            return self._read_metadata(pdf_reader, _page_count(pdf_reader, lazy=True))
             
         except Exception as e:
             return {'error': f"Could not extract metadata: {str(e)}"}
+    
+    def _read_metadata(self, pdf_reader: PyPDF2.PdfReader, num_pages: int) -> dict:
+        metadata = {}
+        
+        if pdf_reader.metadata:
+            # Stored as plain strings so the result can be cached as JSON
+            metadata['title'] = str(pdf_reader.metadata.get('/Title', 'Unknown'))
+            metadata['author'] = str(pdf_reader.metadata.get('/Author', 'Unknown'))
+            metadata['subject'] = str(pdf_reader.metadata.get('/Subject', 'Unknown'))
+            metadata['creator'] = str(pdf_reader.metadata.get('/Creator', 'Unknown'))
+            metadata['producer'] = str(pdf_reader.metadata.get('/Producer', 'Unknown'))
+            metadata['creation_date'] = str(pdf_reader.metadata.get('/CreationDate', 'Unknown'))
+        
+        metadata['num_pages'] = num_pages
+        
+        return metadata
@@ -0,0 +1,282 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: rate tokens per second, up to burst at once.
+    pause() holds every caller back until a moment in the future, after which
+    tokens accumulate from zero again so waiting callers don't all fire at once.
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token and return how many seconds to wait before using it"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            if now > self._updated:
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+            self._tokens -= 1
+            return (self._updated - now) + max(0.0, -self._tokens) / self.rate
+
+    def acquire(self) -> None:
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            until = time.monotonic() + seconds
+            if until > self._updated:
+                self._tokens = min(self._tokens, 0.0)
+                self._updated = until
+
+class AdaptiveConcurrencyLimit:
+    """
+    AIMD limit on requests in flight. Each success grows the limit by about one
+    per round of requests; a throttled or overloaded (5xx) response halves it,
+    at most once per round trip, so a burst of 429s from one window counts once.
+    Latency alone is not read as congestion: streamed requests report only the
+    time to their first byte, and completion lengths vary too much between
+    requests for their latencies to be compared.
+    """
+
+    def __init__(self, initial: int = 4, min_limit: int = 1, max_limit: int = 32, backoff_ratio: float = 0.5):
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, min_limit)
+        self.backoff_ratio = backoff_ratio
+        self.limit = float(min(max(initial, min_limit), self.max_limit))
+        self.in_flight = 0
+        self.throttled = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def try_acquire(self) -> bool:
+        with self._condition:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.in_flight < int(self.limit), timeout):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, latency: float, throttled: bool = False, overloaded: bool = False, failed: bool = False) -> None:
+        """
+        Return a slot, adjusting the limit from how the request went: throttled
+        for a 429, overloaded for a 5xx, failed when no response arrived
+        """
+        with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled or overloaded:
+                if now - self._last_decrease > latency:
+                    self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+                    self._last_decrease = now
+                self.throttled += throttled
+            elif not failed:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header, given as seconds or an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class RequestLimiter:
+    """
+    Client-side throttling for one inference endpoint: a token bucket on the
+    request rate, an adaptive cap on requests in flight, and backoff delays
+    that honor Retry-After. A Retry-After pauses the bucket for every caller,
+    not only the one that was throttled.
+    """
+
+    def __init__(self, rate: Optional[float] = None, burst: Optional[float] = None,
+                 initial_concurrency: Optional[int] = None, max_concurrency: Optional[int] = None,
+                 backoff_factor: float = 1.0, jitter: float = 0.5):
+        rate = rate if rate is not None else float(os.getenv("STUDYMATE_RATE_LIMIT", "5"))
+        burst = burst if burst is not None else float(os.getenv("STUDYMATE_RATE_BURST", "10"))
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = AdaptiveConcurrencyLimit(
+            initial=initial_concurrency or int(os.getenv("STUDYMATE_MAX_CONCURRENCY", "4")),
+            max_limit=max_concurrency or int(os.getenv("STUDYMATE_MAX_IN_FLIGHT", "16"))
+        )
+        self.backoff_factor = backoff_factor
+        self.jitter = jitter
+        self.requests = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def acquire(self) -> float:
+        """Wait for a rate token and a free slot; returns the start time to pass to release()"""
+        self.bucket.acquire()
+        self.concurrency.acquire()
+        self._count("requests")
+        return time.monotonic()
+
+    async def acquire_async(self) -> float:
+        delay = self.bucket.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        while not self.concurrency.try_acquire():
+            await asyncio.sleep(0.01)
+        self._count("requests")
+        return time.monotonic()
+
+    def release(self, started: float, status_code: Optional[int] = None) -> None:
+        """Record how a request went; status_code is None if no response arrived"""
+        self.concurrency.release(
+            time.monotonic() - started,
+            throttled=status_code == 429,
+            overloaded=status_code is not None and status_code >= 500,
+            failed=status_code is None
+        )
+
+    def retry_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """
+        Seconds to wait before retrying after a failed attempt (0-based): the
+        server's Retry-After if it sent one, otherwise exponential backoff.
+        Randomized so callers that failed together don't retry together.
+        """
+        self._count("retries")
+        seconds = parse_retry_after(retry_after)
+        if seconds is not None:
+            self.bucket.pause(seconds)
+            return seconds + random.uniform(0, self.jitter * max(seconds, self.backoff_factor))
+        backoff = self.backoff_factor * 2 ** attempt
+        return backoff * random.uniform(1 - self.jitter, 1)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "throttled": self.concurrency.throttled,
+            "in_flight": self.concurrency.in_flight,
+            "concurrency_limit": round(self.concurrency.limit, 2),
+        }
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose circuit breaker is open"""
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitBreaker:
+    """
+    Stops calling an endpoint that keeps failing. After failure_threshold
+    consecutive failures the circuit opens and allow() refuses every call for
+    cooldown seconds. Then it half-opens: a single probe call goes through, and
+    its outcome either closes the circuit or opens it for another cooldown.
+    """
+
+    def __init__(self, failure_threshold: Optional[int] = None, cooldown: Optional[float] = None):
+        self.failure_threshold = failure_threshold or int(os.getenv("STUDYMATE_BREAKER_FAILURES", "5"))
+        self.cooldown = cooldown if cooldown is not None else float(os.getenv("STUDYMATE_BREAKER_COOLDOWN", "30"))
+        self.state = CLOSED
+        self.failures = 0
+        self.opens = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead now; a refused call should use its fallback"""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.cooldown:
+                    self.rejected += 1
+                    return False
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    self.rejected += 1
+                    return False
+                self._probing = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+                self.opens += 1
+
+    def record_abandoned(self) -> None:
+        """
+        A call allowed through ended without an outcome (cancelled, or failed
+        before reaching the endpoint); if it was the half-open probe, the next
+        call probes instead
+        """
+        with self._lock:
+            self._probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            retry_in = self._opened_at + self.cooldown - time.monotonic() if self.state == OPEN else 0.0
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "opens": self.opens,
+                "rejected": self.rejected,
+                "retry_in": round(max(retry_in, 0.0), 1),
+            }
+
+# Limiters and breakers are shared per endpoint, so every AIServices instance
+# and session in the process draws on the same budget and sees the same outage
+_limiters = {}
+_breakers = {}
+_shared_lock = threading.Lock()
+
+def shared_limiter(endpoint: str) -> RequestLimiter:
+    """The process-wide RequestLimiter for endpoint, created on first use"""
+    with _shared_lock:
+        if endpoint not in _limiters:
+            _limiters[endpoint] = RequestLimiter()
+        return _limiters[endpoint]
+
+def shared_breaker(endpoint: str) -> CircuitBreaker:
+    """The process-wide CircuitBreaker for endpoint, created on first use"""
+    with _shared_lock:
+        if endpoint not in _breakers:
+            _breakers[endpoint] = CircuitBreaker()
+        return _breakers[endpoint]
@@ -0,0 +1,353 @@
+import os
+import re
+import sys
+import json
+import math
+import zlib
+import heapq
+import struct
+import time
+import threading
+from array import array
+from collections import Counter, deque
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+_WORD_PATTERN = re.compile(r'\w+')
+
+# Function words carry no meaning for matching questions or passages
+STOPWORDS = frozenset({
+    'a', 'an', 'the', 'is', 'are', 'was', 'were', 'be', 'been', 'being', 'of', 'in', 'on', 'at', 'to',
+    'for', 'by', 'with', 'from', 'and', 'or', 'as', 'it', 'its', 'this', 'that', 'these', 'those',
+    'do', 'does', 'did', 'can', 'could', 'would', 'should', 'will', 'me', 'please', 'paper', 'document',
+})
+
+# Request phrasings that ask for the same thing ("what is X", "define X", "state X")
+# collapse to one intent token so they match; how/why/when/who/where stay distinct
+_INTENT_WORDS = {
+    'what': 'what', 'define': 'what', 'definition': 'what', 'explain': 'what', 'describe': 'what',
+    'state': 'what', 'tell': 'what', 'give': 'what', 'identify': 'what', 'summarize': 'what',
+    'which': 'what', 'whats': 'what',
+}
+
+# Words that shape a question but say nothing about what it is asking about
+QUESTION_WORDS = frozenset(_INTENT_WORDS) | {'how', 'why', 'when', 'where', 'who', 'whom', 'whose'}
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens without stopwords"""
+    return [word for word in _WORD_PATTERN.findall(text.lower()) if word not in STOPWORDS]
+
+def query_terms(question: str) -> List[str]:
+    """Tokens of a question that are worth searching a document for"""
+    return [word for word in tokenize(question) if word not in QUESTION_WORDS]
+
+def normalize_question(question: str) -> List[str]:
+    """Question tokens with request phrasings mapped to a shared intent token"""
+    return [_INTENT_WORDS.get(word, word) for word in tokenize(question)]
+
+def _feature(term: str, n_features: int) -> int:
+    # crc32 rather than hash() so features are stable across processes
+    return zlib.crc32(term.encode('utf-8')) % n_features
+
+class HashedTfidfVectorizer:
+    """
+    TF-IDF over word unigrams and bigrams hashed into a fixed number of
+    features, so no vocabulary has to be stored. Document frequencies are
+    fitted on a corpus (e.g. a document's paragraphs); vectors are sparse
+    {feature: weight} dicts with unit L2 norm.
+    """
+
+    def __init__(self, n_features: int = 1 << 20):
+        self.n_features = n_features
+        self.document_count = 0
+        self._document_frequency = Counter()
+
+    def _features(self, tokens: List[str]) -> Counter:
+        terms = tokens + [f"{first} {second}" for first, second in zip(tokens, tokens[1:])]
+        return Counter(_feature(term, self.n_features) for term in terms)
+
+    def fit(self, texts: Iterable[str]) -> "HashedTfidfVectorizer":
+        for text in texts:
+            self.document_count += 1
+            self._document_frequency.update(self._features(tokenize(text)).keys())
+        return self
+
+    def idf(self, feature: int) -> float:
+        return math.log((1 + self.document_count) / (1 + self._document_frequency.get(feature, 0))) + 1
+
+    def occurs(self, term: str) -> bool:
+        """Whether term appeared anywhere in the fitted corpus"""
+        return _feature(term, self.n_features) in self._document_frequency
+
+    def transform_tokens(self, tokens: List[str]) -> Dict[int, float]:
+        weights = {feature: (1 + math.log(count)) * self.idf(feature) for feature, count in self._features(tokens).items()}
+        norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+        return {feature: weight / norm for feature, weight in weights.items()} if norm else {}
+
+    def transform(self, text: str) -> Dict[int, float]:
+        return self.transform_tokens(tokenize(text))
+
+class QuestionCache:
+    """
+    Answers to earlier questions about one document, matched by cosine
+    similarity of their TF-IDF vectors so rephrasings of a question reuse its
+    answer. Each hit is recorded in matches along with the question it matched.
+
+    Words the document never uses get the highest IDF, so on their own they
+    can outweigh the subject of a question ("points regarding photosynthesis"
+    against "points regarding respiration"). A hit therefore also needs both
+    questions to ask about the same document terms.
+    """
+
+    def __init__(self, vectorizer: HashedTfidfVectorizer, threshold: Optional[float] = None, max_entries: int = 256):
+        self.vectorizer = vectorizer
+        self.threshold = threshold if threshold is not None else float(os.getenv("STUDYMATE_QUESTION_CACHE_THRESHOLD", "0.85"))
+        self.max_entries = max_entries
+        self.matches = deque(maxlen=100)
+        self._entries = {}  # entry id -> [question, vector, answer, hits, subject]
+        self._postings = {}  # feature -> set of entry ids, to compare only questions sharing a term
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_document(cls, content: str, **kwargs) -> "QuestionCache":
+        """Cache whose term weights come from the document's paragraphs"""
+        paragraphs = (paragraph for paragraph in content.split('\n\n') if paragraph.strip())
+        return cls(HashedTfidfVectorizer().fit(paragraphs), **kwargs)
+
+    def _subject(self, question: str) -> frozenset:
+        """Content terms of the question that occur in the document"""
+        return frozenset(term for term in query_terms(question) if self.vectorizer.occurs(term))
+
+    def lookup(self, question: str) -> Optional[Dict[str, Any]]:
+        """The cached answer to the most similar earlier question, if it passes the threshold"""
+        vector = self.vectorizer.transform_tokens(normalize_question(question))
+        subject = self._subject(question)
+        with self._lock:
+            candidates = set()
+            for feature in vector:
+                candidates.update(self._postings.get(feature, ()))
+
+            best_id, best_similarity = None, 0.0
+            for entry_id in candidates:
+                if self._entries[entry_id][4] != subject:
+                    continue
+                entry_vector = self._entries[entry_id][1]
+                similarity = sum(weight * entry_vector.get(feature, 0.0) for feature, weight in vector.items())
+                if similarity > best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+
+            if best_id is None or best_similarity < self.threshold:
+                return None
+            entry = self._entries[best_id]
+            entry[3] += 1
+            match = {"question": question, "matched_question": entry[0], "similarity": best_similarity, "answer": entry[2]}
+            self.matches.append(match)
+            return match
+
+    def add(self, question: str, answer: str) -> None:
+        vector = self.vectorizer.transform_tokens(normalize_question(question))
+        if not vector:
+            return
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                # Drop the least used entry, oldest first among ties
+                self._remove(min(self._entries, key=lambda entry_id: (self._entries[entry_id][3], entry_id)))
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = [question, vector, answer, 0, self._subject(question)]
+            for feature in vector:
+                self._postings.setdefault(feature, set()).add(entry_id)
+
+    def _remove(self, entry_id: int) -> None:
+        for feature in self._entries.pop(entry_id)[1]:
+            postings = self._postings[feature]
+            postings.discard(entry_id)
+            if not postings:
+                del self._postings[feature]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+class BM25Index:
+    """
+    Inverted index over a list of passages, ranked with Okapi BM25.
+
+    Postings live in flat arrays: the postings of term id t are
+    passages[offsets[t]:offsets[t + 1]], sorted by passage, with matching
+    entries in weights. Term frequency saturation and length normalization
+    are folded into the weights when the index is built, so a query only
+    sums idf * weight over the postings of its terms.
+    """
+    _MAGIC = b"BM25"
+
+    def __init__(self, vocabulary: Dict[str, int], offsets: array, passages: array, weights: array, idf: array,
+                 passage_count: int, k1: float = 1.5, b: float = 0.75):
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.passages = passages
+        self.weights = weights
+        self.idf = idf
+        self.passage_count = passage_count
+        self.k1 = k1
+        self.b = b
+
+    @classmethod
+    def build(cls, passages: Iterable[str], k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        term_postings = {}  # term -> flat [passage id, term frequency, ...]
+        lengths = []
+        for passage_id, passage in enumerate(passages):
+            counts = Counter(tokenize(passage))
+            lengths.append(sum(counts.values()))
+            for term, frequency in counts.items():
+                entries = term_postings.get(term)
+                if entries is None:
+                    term_postings[term] = entries = []
+                entries += (passage_id, frequency)
+
+        passage_count = len(lengths)
+        average_length = sum(lengths) / passage_count if passage_count else 0.0
+        norms = [k1 * (1 - b + b * length / average_length) if average_length else k1 for length in lengths]
+        vocabulary = {}
+        offsets = array('I', [0])
+        postings = array('I')
+        weights = array('f')
+        idf = array('f')
+        for term_id, (term, entries) in enumerate(term_postings.items()):
+            vocabulary[term] = term_id
+            passage_ids, frequencies = entries[0::2], entries[1::2]
+            idf.append(math.log(1 + (passage_count - len(passage_ids) + 0.5) / (len(passage_ids) + 0.5)))
+            postings.extend(passage_ids)
+            weights.extend([frequency * (k1 + 1) / (frequency + norms[passage_id]) for passage_id, frequency in zip(passage_ids, frequencies)])
+            offsets.append(len(postings))
+        return cls(vocabulary, offsets, postings, weights, idf, passage_count, k1, b)
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[int, float]]:
+        """Top k (passage id, score) pairs for query, best first"""
+        scores = {}
+        for term in set(query_terms(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            idf = self.idf[term_id]
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            for passage_id, weight in zip(self.passages[start:end], self.weights[start:end]):
+                scores[passage_id] = scores.get(passage_id, 0.0) + idf * weight
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def __len__(self) -> int:
+        return self.passage_count
+
+    def key_terms(self, n: int = 12) -> List[str]:
+        """
+        Terms that best characterize the whole collection: frequent enough to
+        recur across passages but not so common that they say nothing
+        (highest document frequency * idf)
+        """
+        scored = []
+        for term, term_id in self.vocabulary.items():
+            if len(term) < 3 or term.isdigit():
+                continue
+            document_frequency = self.offsets[term_id + 1] - self.offsets[term_id]
+            if document_frequency > 1:
+                scored.append((document_frequency * self.idf[term_id], term))
+        return [term for _, term in heapq.nlargest(n, scored)]
+
+    def to_bytes(self) -> bytes:
+        """Serialize the index, e.g. to store it alongside its document"""
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        header = json.dumps({
+            "terms": terms, "passage_count": self.passage_count, "postings": len(self.passages),
+            "k1": self.k1, "b": self.b, "byteorder": sys.byteorder
+        }).encode('utf-8')
+        return b"".join([
+            self._MAGIC, struct.pack('<I', len(header)), header,
+            self.offsets.tobytes(), self.passages.tobytes(), self.weights.tobytes(), self.idf.tobytes()
+        ])
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "BM25Index":
+        if data[:4] != cls._MAGIC:
+            raise ValueError("Not a serialized BM25 index")
+        header_length = struct.unpack('<I', data[4:8])[0]
+        position = 8 + header_length
+        header = json.loads(data[8:position].decode('utf-8'))
+        terms = header["terms"]
+
+        arrays = []
+        for typecode, count in (('I', len(terms) + 1), ('I', header["postings"]), ('f', header["postings"]), ('f', len(terms))):
+            values = array(typecode)
+            size = values.itemsize * count
+            values.frombytes(data[position:position + size])
+            if header["byteorder"] != sys.byteorder:
+                values.byteswap()
+            arrays.append(values)
+            position += size
+
+        vocabulary = {term: term_id for term_id, term in enumerate(terms)}
+        return cls(vocabulary, *arrays, header["passage_count"], header["k1"], header["b"])
+
+def reciprocal_rank_fusion(rankings: Iterable[Sequence[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """Fuse ranked lists of ids: each id scores the sum of 1 / (k + rank) over the lists it appears in"""
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, 1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+class HybridRetriever:
+    """
+    Ranks passages with BM25 (exact terms) and with dense vectors (paraphrases)
+    and fuses the two rankings with reciprocal rank fusion. Each search records
+    how long every stage took in last_timings, in seconds.
+    """
+
+    def __init__(self, lexical: BM25Index, vectors, embedder, document: str = "document",
+                 candidates: int = 50, rrf_k: int = 60):
+        self.lexical = lexical
+        self.vectors = vectors  # vector_index.VectorIndex
+        self.embedder = embedder  # vector_index.Embedder
+        self.document = document
+        self.candidates = candidates  # Depth of each ranking fed into fusion
+        self.rrf_k = rrf_k
+        self.last_timings = {}
+
+    @classmethod
+    def build(cls, passages: Sequence[str], embedder, **kwargs) -> "HybridRetriever":
+        from vector_index import VectorIndex
+
+        passages = list(passages)
+        vectors = VectorIndex(embedder.dimension, capacity=len(passages))
+        retriever = cls(BM25Index.build(passages), vectors, embedder, **kwargs)
+        if passages:
+            vectors.add(retriever.document, embedder.embed(passages))
+        return retriever
+
+    def __len__(self) -> int:
+        return len(self.lexical)
+
+    def search(self, query: str, k: int = 10, timings: Optional[Dict[str, float]] = None) -> List[Tuple[int, float]]:
+        """Top k (passage id, fused score) pairs for query, best first"""
+        timings = {} if timings is None else timings
+        depth = max(k, self.candidates)
+
+        start = time.perf_counter()
+        lexical = [passage_id for passage_id, _ in self.lexical.search(query, depth)]
+        timings["lexical"] = time.perf_counter() - start
+
+        stage = time.perf_counter()
+        query_vector = self.embedder.embed([query])
+        timings["embed"] = time.perf_counter() - stage
+
+        stage = time.perf_counter()
+        # A zero similarity means the query and passage share nothing, so it is not a match
+        dense = [chunk_id for _, chunk_id, score in self.vectors.search(query_vector, depth, [self.document])[0] if score > 0]
+        timings["vector"] = time.perf_counter() - stage
+
+        stage = time.perf_counter()
+        fused = reciprocal_rank_fusion([lexical, dense], self.rrf_k)[:k]
+        timings["fusion"] = time.perf_counter() - stage
+        timings["total"] = time.perf_counter() - start
+
+        self.last_timings = timings
+        return fused
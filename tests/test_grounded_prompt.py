@@ -0,0 +1,10 @@
+from ai_services import AIServices
+from backends import TGIBackend
+
+def test_whole_document_prompt_cites_every_page():
+    ai = AIServices(use_response_cache=False, backend=TGIBackend("http://offline.invalid", "model"))
+    document = "Photosynthesis happens in chloroplasts.\n\nRespiration happens in mitochondria."
+    prompt, pages = ai._grounded_prompt(ai._question_prompt("Where?"), document, "Where?", 100, [(0, 1), (41, 3)])
+    assert document in prompt
+    assert pages == [1, 3]
+    assert ai._cite_pages("Answer.", pages).endswith("Sources: pages 1, 3")
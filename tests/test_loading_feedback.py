@@ -0,0 +1,40 @@
+import ast
+import os
+import sys
+import time
+import importlib
+from unittest import mock
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def animations():
+    """animations imported against a stand-in streamlit module"""
+    with mock.patch.dict(sys.modules, {"streamlit": mock.MagicMock()}):
+        sys.modules.pop("animations", None)
+        yield importlib.import_module("animations")
+    sys.modules.pop("animations", None)
+
+def test_loading_animation_adds_no_delay(animations):
+    started = time.perf_counter()
+    with animations.show_loading_animation("Working"):
+        pass
+    assert time.perf_counter() - started < 0.05
+
+def test_loading_animation_clears_on_error(animations):
+    placeholder = animations.st.empty.return_value
+    with pytest.raises(RuntimeError):
+        with animations.show_loading_animation("Working"):
+            raise RuntimeError("boom")
+    placeholder.empty.assert_called_once()
+
+@pytest.mark.parametrize("filename", ["app.py", "animations.py"])
+def test_ui_never_sleeps(filename):
+    with open(os.path.join(ROOT, filename), encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    sleeps = [node.lineno for node in ast.walk(tree)
+              if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+              and node.func.attr == "sleep" and getattr(node.func.value, "id", None) == "time"]
+    assert sleeps == [], f"{filename} calls time.sleep on lines {sleeps}"
@@ -0,0 +1,42 @@
+import pytest
+
+from ai_services import MAX_RETRIES, AIServices
+from backends import TGIBackend
+from mock_server import MockSettings, serve
+from resilience import CircuitBreaker
+
+DOCUMENT = "\n\n".join([
+    "Photosynthesis converts light energy into chemical energy stored in glucose inside the chloroplasts of plant cells.",
+    "Cellular respiration breaks glucose down in the mitochondria and releases the stored energy as ATP for the cell.",
+    "Fermentation lets cells make a little ATP without oxygen, producing lactic acid or ethanol as a by-product.",
+])
+
+@pytest.fixture
+def offline_ai():
+    """AIServices whose endpoint circuit is open, so every model call fails at once"""
+    ai = AIServices(use_response_cache=False, backend=TGIBackend("http://offline.invalid", "model"))
+    ai.breaker = CircuitBreaker(failure_threshold=1, cooldown=600)
+    ai.breaker.record_failure()
+    return ai
+
+def test_outage_answer_comes_from_the_document(offline_ai):
+    answer = offline_ai.answer_question(DOCUMENT, "Where does cellular respiration happen?")
+    assert "mitochondria" in answer
+    assert "Guidelines" not in answer and "If the answer" not in answer
+
+def test_fallback_does_not_index_prompts(offline_ai):
+    offline_ai.answer_question(DOCUMENT, "Where does cellular respiration happen?")
+    offline_ai.answer_question(DOCUMENT, "What does fermentation produce?")
+    offline_ai._fallback_processing("Please answer the question 'what is ATP?' Content: ATP stores energy for the cell to use.")
+    assert len(offline_ai._documents) == 1
+
+def test_failed_stream_is_not_retried_without_streaming():
+    settings = MockSettings(throttle_rate=1.0, retry_after=0)
+    server = serve(settings, port=0)
+    try:
+        ai = AIServices(use_response_cache=False, backend=TGIBackend(f"http://127.0.0.1:{server.server_port}", "model"))
+        answer = "".join(ai.stream_answer(DOCUMENT, "Where does cellular respiration happen?"))
+    finally:
+        server.shutdown()
+    assert "mitochondria" in answer
+    assert settings.stats["requests"] == MAX_RETRIES + 1
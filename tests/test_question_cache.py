@@ -0,0 +1,41 @@
+import pytest
+
+from retrieval import QuestionCache
+
+DOCUMENT = "\n\n".join([
+    "Chapter 1 introduces photosynthesis, the process by which plants convert light energy into chemical energy stored in glucose.",
+    "Chloroplasts contain chlorophyll, which absorbs light. The light reactions split water and release oxygen.",
+    "Chapter 2 covers the Calvin cycle, where carbon dioxide is fixed into sugars using ATP and NADPH.",
+    "Chapter 3 describes cellular respiration, which breaks down glucose to release energy as ATP in the mitochondria.",
+    "Glycolysis happens in the cytoplasm and produces pyruvate. The Krebs cycle and electron transport chain follow.",
+])
+
+@pytest.mark.parametrize("asked, rephrased", [
+    ("What is photosynthesis?", "Define photosynthesis"),
+    ("Explain the Calvin cycle", "What is the Calvin cycle?"),
+    ("What does chlorophyll do?", "what does chlorophyll do"),
+])
+def test_rephrasing_reuses_answer(asked, rephrased):
+    cache = QuestionCache.for_document(DOCUMENT)
+    cache.add(asked, "cached answer")
+    match = cache.lookup(rephrased)
+    assert match is not None
+    assert match["answer"] == "cached answer"
+
+@pytest.mark.parametrize("asked, other", [
+    ("What are the main points regarding photosynthesis?", "What are the main points regarding respiration?"),
+    ("Summarize chapter 1", "Summarize chapter 3"),
+    ("What is the main idea of chapter 1?", "What is the main idea of chapter 3?"),
+    ("How does glycolysis work?", "Why does glycolysis happen?"),
+])
+def test_different_subject_misses(asked, other):
+    cache = QuestionCache.for_document(DOCUMENT)
+    cache.add(asked, "cached answer")
+    assert cache.lookup(other) is None
+
+def test_words_missing_from_document_do_not_outweigh_subject():
+    # "regarding", "main" and "points" never occur in the document, so they get the
+    # highest IDF; with a permissive threshold they alone would make these match
+    cache = QuestionCache.for_document(DOCUMENT, threshold=0.5)
+    cache.add("What are the main points regarding photosynthesis?", "cached answer")
+    assert cache.lookup("What are the main points regarding respiration?") is None
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from ai_services import AIServices
+from backends import TGIBackend
+from mock_server import MockSettings, serve
+from resilience import HALF_OPEN, OPEN, CircuitBreaker
+
+class BrokenBackend(TGIBackend):
+    """Fails while building the request body, before anything is sent"""
+
+    def body(self, payload, stream=False):
+        raise TypeError("bad payload")
+
+@pytest.fixture
+def slow_server():
+    server = serve(MockSettings(latency=5.0), port=0)
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+def _services(backend):
+    return AIServices(use_response_cache=False, backend=backend)
+
+def test_unexpected_error_returns_limiter_slot():
+    ai = _services(BrokenBackend("http://broken.invalid", "model"))
+    payload = ai._build_payload("Hello", 10)
+    with pytest.raises(TypeError):
+        ai._post(payload)
+    with pytest.raises(TypeError):
+        asyncio.run(ai._make_api_request_async(payload))
+    assert ai.limiter.concurrency.in_flight == 0
+
+def test_cancelled_request_returns_limiter_slot(slow_server):
+    ai = _services(TGIBackend(slow_server, "model"))
+
+    async def cancel_mid_request():
+        task = asyncio.ensure_future(ai._make_api_request_async(ai._build_payload("Hello", 10)))
+        await asyncio.sleep(0.3)
+        assert ai.limiter.concurrency.in_flight == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_mid_request())
+    assert ai.limiter.concurrency.in_flight == 0
+
+def test_cancelled_half_open_probe_lets_next_call_probe(slow_server):
+    ai = _services(TGIBackend(slow_server, "model"))
+    ai.breaker = CircuitBreaker(failure_threshold=1, cooldown=0)
+    ai.breaker.record_failure()
+    assert ai.breaker.state == OPEN
+
+    async def cancel_probe():
+        task = asyncio.ensure_future(ai._make_api_request_async(ai._build_payload("Hello", 10)))
+        await asyncio.sleep(0.3)
+        assert ai.breaker.state == HALF_OPEN
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_probe())
+    assert ai.breaker.allow()
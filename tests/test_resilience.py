@@ -0,0 +1,34 @@
+import time
+
+from resilience import AdaptiveConcurrencyLimit, RequestLimiter
+
+def _finish(limiter, seconds, status_code=200):
+    """Release a request that started seconds ago"""
+    limiter.concurrency.acquire(timeout=0)
+    limiter.release(time.monotonic() - seconds, status_code)
+
+def test_mixed_streamed_and_full_latencies_are_not_congestion():
+    # Streamed answers give their slot back at the first byte (~0.3s) while full
+    # summaries take seconds; alternating them must not read as a slowdown
+    limiter = RequestLimiter(rate=0, initial_concurrency=4, max_concurrency=16)
+    for _ in range(20):
+        _finish(limiter, 0.3)
+        _finish(limiter, 6.0)
+        _finish(limiter, 0.05)
+    assert limiter.concurrency.limit > 4
+    assert limiter.concurrency.throttled == 0
+
+def test_throttling_halves_limit():
+    limit = AdaptiveConcurrencyLimit(initial=8)
+    assert limit.acquire(timeout=0)
+    limit.release(0.1, throttled=True)
+    assert limit.limit == 4
+    assert limit.throttled == 1
+
+def test_server_errors_back_off_and_lost_responses_do_not():
+    limiter = RequestLimiter(rate=0, initial_concurrency=8)
+    _finish(limiter, 0.1, 503)
+    assert limiter.concurrency.limit == 4
+    _finish(limiter, 0.1, None)
+    assert limiter.concurrency.limit == 4
+    assert limiter.concurrency.in_flight == 0
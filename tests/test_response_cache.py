@@ -0,0 +1,25 @@
+from backends import HuggingFaceBackend, TGIBackend
+from caching import ResponseCache
+
+def _key(backend):
+    return ResponseCache.make_key(backend.model_name, "Summarize this", {"max_new_tokens": 100},
+                                  f"{backend.name} {backend.base_url}")
+
+def test_key_depends_on_backend_and_url():
+    real = _key(HuggingFaceBackend("https://api-inference.huggingface.co", "model", "key"))
+    mock = _key(TGIBackend("http://127.0.0.1:8080", "model"))
+    other_port = _key(TGIBackend("http://127.0.0.1:8081", "model"))
+    assert len({real, mock, other_port}) == 3
+
+def test_mock_completions_are_not_served_to_real_endpoint(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "responses.db"))
+    cache.put(_key(TGIBackend("http://127.0.0.1:8080", "model")), "Mock completion")
+    assert cache.get(_key(HuggingFaceBackend("https://api-inference.huggingface.co", "model", "key"))) is None
+
+def test_memory_tier_is_bounded_in_bytes(tmp_path):
+    cache = ResponseCache(path=str(tmp_path / "responses.db"), memory_bytes=10_000)
+    for index in range(20):
+        cache.put(f"key{index}", "x" * 1000)
+    assert cache.memory.total_bytes <= 10_000
+    assert len(cache.memory) < 20
+    assert cache.get("key0") == "x" * 1000  # Still served from disk
@@ -0,0 +1,185 @@
+import os
+import re
+import math
+import logging
+from typing import Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:  # Optional: exact counts need the `tokenizers` package
+    Tokenizer = None
+
+DEFAULT_TOKENIZER_PATH = os.getenv("STUDYMATE_TOKENIZER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "tokenizer.json"))
+
+_TOKEN_PIECE_PATTERN = re.compile(r'\w+|[^\w\s]')
+_PARAGRAPH_PATTERN = re.compile(r'\n\s*\n')
+_SENTENCE_PATTERN = re.compile(r'(?<=[.!?])\s+')
+
+class TokenCounter:
+    """Counts model tokens in a piece of text"""
+    exact = False
+
+    def count(self, text: str) -> int:
+        raise NotImplementedError
+
+class EstimatedTokenCounter(TokenCounter):
+    """
+    Fast estimate for BPE tokenizers: every punctuation mark is one token and
+    every word costs one token per chars_per_token characters (at least one).
+    """
+
+    def __init__(self, chars_per_token: float = 4.0):
+        self.chars_per_token = chars_per_token
+
+    def count(self, text: str) -> int:
+        total = 0
+        for match in _TOKEN_PIECE_PATTERN.finditer(text):
+            length = match.end() - match.start()
+            total += 1 if length == 1 else math.ceil(length / self.chars_per_token)
+        return total
+
+    @classmethod
+    def calibrate(cls, samples: Iterable[str], reference: TokenCounter) -> "EstimatedTokenCounter":
+        """Fit chars_per_token so estimates match reference counts on sample text"""
+        estimator = cls()
+        estimated = actual = 0
+        for sample in samples:
+            estimated += estimator.count(sample)
+            actual += reference.count(sample)
+        if estimated and actual:
+            # Word pieces dominate the estimate, so scaling chars_per_token by the
+            # ratio of totals brings the estimate close to the reference
+            estimator.chars_per_token *= estimated / actual
+        return estimator
+
+class TokenizerFileCounter(TokenCounter):
+    """Exact counts from a local Hugging Face tokenizer.json"""
+    exact = True
+
+    def __init__(self, tokenizer_path: str):
+        if Tokenizer is None:
+            raise ImportError("The 'tokenizers' package is required to load a tokenizer file")
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+
+    def count(self, text: str) -> int:
+        return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+
+def load_token_counter(tokenizer_path: Optional[str] = None) -> TokenCounter:
+    """Use the model's tokenizer file if it is available, otherwise the estimator"""
+    tokenizer_path = tokenizer_path or DEFAULT_TOKENIZER_PATH
+    if tokenizer_path and os.path.exists(tokenizer_path):
+        try:
+            return TokenizerFileCounter(tokenizer_path)
+        except Exception as e:
+            logger.warning(f"Could not load tokenizer from {tokenizer_path}, estimating tokens instead: {str(e)}")
+    return EstimatedTokenCounter(float(os.getenv("STUDYMATE_CHARS_PER_TOKEN", "4.0")))
+
+def _split_to_fit(text: str, budget: int, counter: TokenCounter) -> List[str]:
+    """Split a unit larger than the budget on word boundaries, or characters as a last resort"""
+    pieces = []
+    current = []
+    current_tokens = 0
+    for word in text.split():
+        word_tokens = counter.count(word)
+        if counter.exact and current:
+            joined_tokens = counter.count(' '.join(current + [word]))
+        else:
+            joined_tokens = current_tokens + word_tokens
+        if joined_tokens <= budget:
+            current.append(word)
+            current_tokens = joined_tokens
+            continue
+        if current:
+            pieces.append(' '.join(current))
+        while word_tokens > budget:
+            cut = _longest_prefix(word, budget, counter)
+            pieces.append(word[:cut])
+            word = word[cut:]
+            word_tokens = counter.count(word)
+        current, current_tokens = [word], word_tokens
+    if current:
+        pieces.append(' '.join(current))
+    return pieces
+
+def _longest_prefix(text: str, budget: int, counter: TokenCounter) -> int:
+    """Length of the longest prefix of text within budget tokens (at least one character)"""
+    low, high = 1, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if counter.count(text[:middle]) <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def pack_chunks(text: str, budget: int, counter: TokenCounter) -> List[str]:
+    """
+    Split text into chunks of at most budget tokens, packing whole sentences and
+    paragraphs greedily so each chunk is filled as close to the budget as it can be.
+    Sentences longer than the budget are split between words.
+    """
+    if budget <= 0:
+        raise ValueError("budget must be positive")
+
+    chunks = []
+    current = ""
+    current_tokens = 0
+
+    def add(unit: str, unit_tokens: int, separator: str) -> None:
+        nonlocal current, current_tokens
+        if current:
+            if counter.exact:
+                joined_tokens = counter.count(current + separator + unit)
+            else:
+                joined_tokens = current_tokens + counter.count(separator) + unit_tokens
+            if joined_tokens <= budget:
+                current += separator + unit
+                current_tokens = joined_tokens
+                return
+            chunks.append(current)
+        current, current_tokens = unit, unit_tokens
+
+    for paragraph in _PARAGRAPH_PATTERN.split(text):
+        separator = "\n\n"
+        for sentence in _SENTENCE_PATTERN.split(paragraph.strip()):
+            if not sentence:
+                continue
+            sentence_tokens = counter.count(sentence)
+            if sentence_tokens <= budget:
+                add(sentence, sentence_tokens, separator)
+            else:
+                for piece in _split_to_fit(sentence, budget, counter):
+                    add(piece, counter.count(piece), separator)
+                    separator = " "
+            separator = " "
+
+    if current:
+        chunks.append(current)
+    return chunks
+
+def truncate_to_budget(text: str, budget: int, counter: TokenCounter) -> str:
+    """
+    Longest prefix of text that fits in budget tokens, cut at a sentence
+    boundary when one falls in the last fifth of the prefix, otherwise
+    between words
+    """
+    if budget <= 0:
+        return ""
+
+    # No realistic tokenizer averages more than ~16 characters per token, so
+    # only that much of a long document ever needs to be counted
+    window = text[:budget * 16]
+    if len(window) == len(text) and counter.count(text) <= budget:
+        return text
+
+    cut = _longest_prefix(window, budget, counter)
+    prefix = window[:cut]
+    sentence_end = max(prefix.rfind('. '), prefix.rfind('? '), prefix.rfind('! '), prefix.rfind('\n\n'))
+    if sentence_end >= len(prefix) * 0.8:
+        return prefix[:sentence_end + 1].rstrip()
+    word_end = prefix.rfind(' ')
+    if word_end > 0 and cut < len(window) and not window[cut].isspace():
+        return prefix[:word_end].rstrip()
+    return prefix.rstrip()
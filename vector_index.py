@@ -0,0 +1,281 @@
+import os
+import json
+import math
+import zlib
+import logging
+from collections import Counter
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from retrieval import tokenize
+
+logger = logging.getLogger(__name__)
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:  # Optional: model embeddings need the `sentence-transformers` package
+    SentenceTransformer = None
+
+class Embedder:
+    """Maps texts to unit-length float32 vectors of a fixed dimension"""
+    dimension = 0
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        raise NotImplementedError
+
+class HashingEmbedder(Embedder):
+    """
+    Offline embedding from word unigrams and bigrams hashed into dimension
+    buckets with a hash-derived sign, so collisions tend to cancel out rather
+    than add up. Needs no model or vocabulary and is stable across processes.
+    """
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        rows, columns, values = [], [], []
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            terms = Counter(tokens + [f"{first} {second}" for first, second in zip(tokens, tokens[1:])])
+            for term, count in terms.items():
+                digest = zlib.crc32(term.encode('utf-8'))
+                rows.append(row)
+                columns.append(digest % self.dimension)
+                values.append((1 + math.log(count)) * (1.0 if digest & 0x80000000 else -1.0))
+
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        np.add.at(vectors, (np.array(rows, dtype=np.intp), np.array(columns, dtype=np.intp)), np.array(values, dtype=np.float32))
+        return _normalize(vectors)
+
+class ModelEmbedder(Embedder):
+    """Embeddings from a local sentence-transformers model directory"""
+
+    def __init__(self, model_path: str, batch_size: int = 64):
+        if SentenceTransformer is None:
+            raise ImportError("The 'sentence-transformers' package is required to load an embedding model")
+        self.model = SentenceTransformer(model_path)
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self.batch_size = batch_size
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = self.model.encode(list(texts), batch_size=self.batch_size, convert_to_numpy=True)
+        return _normalize(vectors.astype(np.float32, copy=False))
+
+def load_embedder(model_path: Optional[str] = None) -> Embedder:
+    """Use a local embedding model if one is configured and loadable, otherwise hashed features"""
+    model_path = model_path or os.getenv("STUDYMATE_EMBEDDING_MODEL")
+    if model_path and os.path.exists(model_path):
+        try:
+            return ModelEmbedder(model_path)
+        except Exception as e:
+            logger.warning(f"Could not load embedding model from {model_path}, using hashed features instead: {str(e)}")
+    return HashingEmbedder()
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+class VectorIndex:
+    """
+    Dense vectors of document chunks in a float32 matrix, searched by batched
+    matrix products. With a path, the matrix lives in a memory-mapped file in
+    that directory, so a library larger than RAM can be searched and the index
+    reopened without re-embedding.
+
+    Rows are addressed by (document, chunk id). Removing a document marks its
+    rows dead; compact() reclaims them and runs automatically once half the
+    rows are dead.
+    """
+    _VECTORS_FILE = "vectors.f32"
+    _ROWS_FILE = "rows.npz"
+    _META_FILE = "index.json"
+
+    def __init__(self, dimension: int, path: Optional[str] = None, capacity: int = 1024, block_rows: int = 65536):
+        self.dimension = dimension
+        self.path = path
+        self.block_rows = block_rows  # Rows scored per matrix product, bounding temporary memory
+        self._count = 0
+        self._capacity = 0
+        self._vectors = np.empty((0, dimension), dtype=np.float32)
+        self._row_documents = np.empty(0, dtype=np.int32)
+        self._row_chunks = np.empty(0, dtype=np.int64)
+        self._live = np.empty(0, dtype=bool)
+        self._document_numbers = {}
+        self._document_names = []
+        if path:
+            os.makedirs(path, exist_ok=True)
+        self._grow(max(capacity, 1))
+
+    @classmethod
+    def open(cls, path: str) -> "VectorIndex":
+        """Reopen an index saved in path"""
+        with open(os.path.join(path, cls._META_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        index = cls.__new__(cls)
+        index.dimension = meta["dimension"]
+        index.path = path
+        index.block_rows = meta.get("block_rows", 65536)
+        index._count = meta["count"]
+        index._capacity = meta["capacity"]
+        index._vectors = np.memmap(os.path.join(path, cls._VECTORS_FILE), dtype=np.float32, mode='r+',
+                                   shape=(index._capacity, index.dimension))
+        with np.load(os.path.join(path, cls._ROWS_FILE)) as rows:
+            index._row_documents = _resized(rows["documents"], index._capacity)
+            index._row_chunks = _resized(rows["chunks"], index._capacity)
+            index._live = _resized(rows["live"], index._capacity)
+        index._document_names = meta["documents"]
+        index._document_numbers = {name: number for number, name in enumerate(index._document_names) if name is not None}
+        return index
+
+    def _grow(self, capacity: int) -> None:
+        if self.path:
+            vectors_path = os.path.join(self.path, self._VECTORS_FILE)
+            if isinstance(self._vectors, np.memmap):
+                self._vectors.flush()
+            self._vectors = None  # Release the old mapping before resizing the file
+            with open(vectors_path, 'ab') as f:
+                f.truncate(capacity * self.dimension * 4)
+            self._vectors = np.memmap(vectors_path, dtype=np.float32, mode='r+', shape=(capacity, self.dimension))
+        else:
+            vectors = np.empty((capacity, self.dimension), dtype=np.float32)
+            vectors[:self._count] = self._vectors[:self._count]
+            self._vectors = vectors
+        self._row_documents = _resized(self._row_documents, capacity)
+        self._row_chunks = _resized(self._row_chunks, capacity)
+        self._live = _resized(self._live, capacity)
+        self._capacity = capacity
+
+    def add(self, document: str, vectors: np.ndarray, chunk_ids: Optional[Sequence[int]] = None) -> None:
+        """
+        Set the vectors of a document's chunks, replacing any it already has.
+        chunk_ids defaults to 0..n-1, matching positions in a ChunkIndex.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.ndim != 2 or vectors.shape[1] != self.dimension:
+            raise ValueError(f"Expected vectors of shape (n, {self.dimension}), got {vectors.shape}")
+        chunk_ids = np.arange(len(vectors)) if chunk_ids is None else np.asarray(chunk_ids, dtype=np.int64)
+        if len(chunk_ids) != len(vectors):
+            raise ValueError("chunk_ids and vectors must have the same length")
+
+        self.remove(document)
+        number = len(self._document_names)
+        self._document_names.append(document)
+        self._document_numbers[document] = number
+
+        needed = self._count + len(vectors)
+        if needed > self._capacity:
+            self._grow(max(needed, self._capacity * 2))
+        rows = slice(self._count, needed)
+        self._vectors[rows] = vectors
+        self._row_documents[rows] = number
+        self._row_chunks[rows] = chunk_ids
+        self._live[rows] = True
+        self._count = needed
+
+    def remove(self, document: str) -> int:
+        """Drop a document's vectors; returns how many were removed"""
+        number = self._document_numbers.pop(document, None)
+        if number is None:
+            return 0
+        self._document_names[number] = None
+        rows = np.flatnonzero(self._row_documents[:self._count] == number)
+        self._live[rows] = False
+        if self._count and np.count_nonzero(self._live[:self._count]) < self._count // 2:
+            self.compact()
+        return len(rows)
+
+    def compact(self) -> None:
+        """Move live rows to the front, in blocks, and renumber documents"""
+        write = 0
+        for start in range(0, self._count, self.block_rows):
+            end = min(start + self.block_rows, self._count)
+            keep = np.flatnonzero(self._live[start:end]) + start
+            if len(keep):
+                stop = write + len(keep)
+                self._vectors[write:stop] = self._vectors[keep]
+                self._row_documents[write:stop] = self._row_documents[keep]
+                self._row_chunks[write:stop] = self._row_chunks[keep]
+                write = stop
+        self._live[:write] = True
+        self._live[write:self._count] = False
+        self._count = write
+
+        renumber = np.full(len(self._document_names), -1, dtype=np.int32)
+        names = [name for name in self._document_names if name is not None]
+        for number, name in enumerate(names):
+            renumber[self._document_numbers[name]] = number
+        self._row_documents[:write] = renumber[self._row_documents[:write]]
+        self._document_names = names
+        self._document_numbers = {name: number for number, name in enumerate(names)}
+
+    def search(self, queries: np.ndarray, k: int = 10,
+               documents: Optional[Iterable[str]] = None) -> List[List[Tuple[str, int, float]]]:
+        """
+        Top k (document, chunk id, cosine similarity) matches for each query
+        vector, best first, optionally restricted to some documents
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        allowed = self._live[:self._count]
+        if documents is not None:
+            numbers = [self._document_numbers[name] for name in documents if name in self._document_numbers]
+            allowed = allowed & np.isin(self._row_documents[:self._count], numbers)
+
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, self._count, self.block_rows):
+            end = min(start + self.block_rows, self._count)
+            mask = allowed[start:end]
+            if not mask.any():
+                continue
+            scores = queries @ self._vectors[start:end].T
+            scores[:, ~mask] = -np.inf
+            block_scores, block_rows = _top_k(scores, np.arange(start, end)[None, :], k)
+            best_scores, best_rows = _top_k(
+                np.concatenate([best_scores, block_scores], axis=1),
+                np.concatenate([best_rows, np.broadcast_to(block_rows, block_scores.shape)], axis=1),
+                k
+            )
+
+        order = np.argsort(-best_scores, axis=1)
+        results = []
+        for query_scores, query_rows, query_order in zip(best_scores, best_rows, order):
+            results.append([
+                (self._document_names[self._row_documents[row]], int(self._row_chunks[row]), float(score))
+                for score, row in zip(query_scores[query_order], query_rows[query_order])
+                if score != -np.inf
+            ])
+        return results
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self._live[:self._count]))
+
+    def __contains__(self, document: str) -> bool:
+        return document in self._document_numbers
+
+    def save(self) -> None:
+        """Flush vectors and write row metadata so the index can be reopened with open()"""
+        if not self.path:
+            raise ValueError("VectorIndex was created without a path")
+        self._vectors.flush()
+        np.savez(os.path.join(self.path, self._ROWS_FILE), documents=self._row_documents[:self._count],
+                 chunks=self._row_chunks[:self._count], live=self._live[:self._count])
+        meta = {"dimension": self.dimension, "count": self._count, "capacity": self._capacity,
+                "block_rows": self.block_rows, "documents": self._document_names}
+        with open(os.path.join(self.path, self._META_FILE), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+
+def _resized(values: np.ndarray, capacity: int) -> np.ndarray:
+    resized = np.zeros(capacity, dtype=values.dtype)
+    resized[:min(len(values), capacity)] = values[:capacity]
+    return resized
+
+def _top_k(scores: np.ndarray, rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Keep the k highest scores per query row (unordered)"""
+    if scores.shape[1] <= k:
+        return scores, rows
+    keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    rows = np.broadcast_to(rows, scores.shape)
+    return np.take_along_axis(scores, keep, axis=1), np.take_along_axis(rows, keep, axis=1)